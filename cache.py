@@ -0,0 +1,93 @@
+from collections import OrderedDict
+from threading import RLock
+import numpy as np
+
+def sizeOf(obj):
+    '''
+    Bytes held in memory by obj,
+    memory-mapped arrays live in the page cache and count as nothing
+    '''
+    if isinstance(obj, np.memmap):
+        return 0
+    if isinstance(obj, np.ndarray):
+        if obj.dtype.hasobject:
+            return obj.nbytes + sum(sizeOf(o) for o in obj.flat)
+        return obj.nbytes
+    if isinstance(obj, dict):
+        return sum(sizeOf(v) for v in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(sizeOf(v) for v in obj)
+    return 0
+
+class DataCache(object):
+    '''
+    LRU cache for track data and module results with a byte budget,
+    evicted items are loaded again by the loader passed to get
+    '''
+    DEFAULTBUDGET = 1<<30
+
+    def __init__(self, budget=DEFAULTBUDGET):
+        self.budget = budget
+        self.items = OrderedDict() # key -> (value, size)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = RLock()
+
+    def get(self, key, loader):
+        with self.lock:
+            if key in self.items:
+                self.items.move_to_end(key)
+                self.hits += 1
+                return self.items[key][0]
+            self.misses += 1
+        value = loader()
+        self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        size = sizeOf(value)
+        with self.lock:
+            if key in self.items:
+                self.size -= self.items.pop(key)[1]
+            self.items[key] = (value, size)
+            self.size += size
+            self.evict()
+
+    def remove(self, key):
+        # the values dropped are returned, to close their files
+        return self.removePrefix(key, exact=True)
+
+    def removePrefix(self, prefix, exact=False):
+        # e.g. ('result',guid) drops the per-track entries of a result too
+        n = len(prefix)
+        values = []
+        with self.lock:
+            for key in [k for k in self.items if (k==prefix if exact else k[:n]==prefix)]:
+                (value, size) = self.items.pop(key)
+                self.size -= size
+                values.append(value)
+        return values
+
+    def evict(self):
+        # the newest item is kept even if it alone exceeds the budget
+        while self.size>self.budget and len(self.items)>1:
+            (key, (value, size)) = self.items.popitem(last=False)
+            self.size -= size
+            self.evictions += 1
+
+    def setBudget(self, budget):
+        with self.lock:
+            self.budget = budget
+            self.evict()
+
+    def getStats(self):
+        return {
+            'hits':self.hits,
+            'misses':self.misses,
+            'evictions':self.evictions,
+            'items':len(self.items),
+            'bytes':self.size,
+            'budget':self.budget
+        }
@@ -2,6 +2,7 @@ moduleManager = None
 projectManager = None
 plotManager = None
 progressManager = None
+dataCache = None
 
 # this can be used not called by 'main', so in 'gl'
 from PyQt4 import QtGui
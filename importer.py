@@ -0,0 +1,98 @@
+from scipy.io import loadmat, whosmat
+from rdsp import storage
+import numpy as np, uuid
+
+class OrosMatReader(object):
+    '''
+    Read an Oros mat file track by track,
+    only one TrackN array is in memory at a time.
+    v7.3 (HDF5-backed) files are read through h5py.
+    '''
+    def __init__(self, matpath):
+        self.matpath = matpath
+        self.h5 = None
+        try:
+            names = [name for (name,shape,cls) in whosmat(matpath)]
+        except NotImplementedError:
+            # scipy refuses v7.3 files, they are HDF5 inside
+            import h5py
+            self.h5 = h5py.File(matpath,'r')
+            names = list(self.h5.keys())
+
+        self.names = set(names)
+        n = 0
+        while ('Track%d' % (n+1)) in self.names:
+            n += 1
+        self.count = n
+        self.info = self.load([
+            name for name in names if not self.isTrackData(name)
+        ])
+
+    def isTrackData(self, name):
+        return name.startswith('Track') and name[5:].isdigit()
+
+    def load(self, names):
+        if self.h5 is None:
+            return loadmat(self.matpath, variable_names=names)
+        # matlab stores column-major, transpose back to the loadmat layout
+        mat = {}
+        for name in names:
+            ds = self.h5[name]
+            if not hasattr(ds, 'shape'): continue
+            value = np.array(ds).T
+            if ds.attrs.get('MATLAB_class',b'')==b'char':
+                value = np.array([''.join(chr(c) for c in value.flatten())])
+            mat[name] = value
+        return mat
+
+    def getString(self, name):
+        return str(self.info[name][0])
+
+    def getScalar(self, name):
+        return self.info[name].flatten()[0]
+
+    def getTrackConfig(self, i):
+        return {
+            'name':self.getString('Track%d_Name' % i),
+            'config':{
+                'bandwidth':int(self.getScalar('Track%d_TrueBandWidth' % i)),
+                'c1':float(self.getScalar('Track%d_Sensitivity' % i)),
+                'c0':float(self.getScalar('Track%d_Offset' % i)),
+                'x-unit':self.getString('Track%d_X_Magnitude' % i),
+                'y-unit':self.getString('Track%d_Y_Magnitude' % i)
+            }
+        }
+
+    def getTrackData(self, i):
+        # always (1,N) as the tracks in source/
+        name = 'Track%d' % i
+        return self.load([name])[name].reshape(1,-1)
+
+    def getDate(self):
+        return self.getString('RecordDate')
+
+    def close(self):
+        if self.h5 is not None:
+            self.h5.close()
+            self.h5 = None
+
+def importOrosMat(matpath, sourceDir, loi=None, chunked=False):
+    '''
+    Write every track of matpath into sourceDir,
+    returns (date, tracksConfig) for SignalModule.
+    Module level so it can run in a worker process.
+    '''
+    reader = OrosMatReader(matpath)
+    tracks = []
+    try:
+        if loi is not None: loi[0] = reader.count
+        for i in range(1,reader.count+1):
+            tc = reader.getTrackConfig(i)
+            tc['guid'] = str(uuid.uuid4())
+            storage.saveTrack(sourceDir, tc['guid'], reader.getTrackData(i), chunked)
+            tracks.append(tc)
+            if loi is not None: loi[1] += 1
+        date = reader.getDate()
+    finally:
+        reader.close()
+    return (date, tracks)
@@ -1,10 +1,11 @@
 from PyQt4.QtGui import (QMainWindow, QWidget, QGridLayout, QVBoxLayout,
-    QFileDialog, QMessageBox, QSplashScreen, QPixmap, QProgressBar)
+    QFileDialog, QMessageBox, QSplashScreen, QPixmap, QProgressBar, QInputDialog, QPushButton)
 from PyQt4.QtCore import QSettings, Qt
 from guidata.qthelpers import create_action, add_actions
 
 from rdsp.widgets import ListWidget, PropertyWidget, PlotWidget
 from rdsp.manager import ProjectManager, ModuleManager, ProgressManager, PlotManager
+from rdsp.cache import DataCache
 from rdsp import gl
 
 from os import path
@@ -13,16 +14,19 @@ APPNAME = 'RDSP'
 
 RECENT_PROJ = 'recentProj'
 RECEN_MAT = 'recentMat'
+CHUNKED_TRACK = 'chunkedTrack'
+CACHE_BUDGET = 'cacheBudget'
 MODULEDIR = 'modules/'
 
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
         self.recentSetting = QSettings('AHC','rdsp')
+        gl.dataCache = DataCache(self.recentSetting.value(CACHE_BUDGET,DataCache.DEFAULTBUDGET,type=int))
         self.initUI()
         self.resize(1024,768)
 
-        gl.progressManager = ProgressManager(self.statusBar(),self.progress_bar)
+        gl.progressManager = ProgressManager(self.statusBar(),self.progress_bar,self.cancel_button)
         gl.plotManager = PlotManager(self.toolBar, self.plot_widget, self)
         ProjectManager.RegisterListWidget(self.list_widget)
 
@@ -33,10 +37,14 @@ class MainWindow(QMainWindow):
         new_proj_action = create_action(self, 'New Project', self.new_project)
         open_proj_action = create_action(self, 'Open Project', self.open_project)
         import_orosMat_action = create_action(self, 'Import Oros Mat', self.import_orosMat)
+        import_orosMats_action = create_action(self, 'Import Oros Mats', self.import_orosMats)
+        chunked_action = create_action(self, 'Compressed Track Storage', toggled=self.toggle_chunked)
+        chunked_action.setChecked(self.recentSetting.value(CHUNKED_TRACK,False,type=bool))
+        cache_action = create_action(self, 'Data Cache', self.data_cache)
         quit_action = create_action(self, 'Quit', self.quit)
         add_actions(file_menu, (
             new_proj_action,open_proj_action,
-            None,import_orosMat_action,None,quit_action
+            None,import_orosMat_action,import_orosMats_action,chunked_action,cache_action,None,quit_action
         ))
 
         progress_bar = QProgressBar(self)
@@ -45,6 +53,10 @@ class MainWindow(QMainWindow):
         progress_bar.setVisible(False)
         self.progress_bar = progress_bar
         self.statusBar().addPermanentWidget(progress_bar)
+        cancel_button = QPushButton('Cancel', self)
+        cancel_button.setVisible(False)
+        self.cancel_button = cancel_button
+        self.statusBar().addPermanentWidget(cancel_button)
 
         self.toolBar = self.addToolBar('Curves')
 
@@ -70,6 +82,21 @@ class MainWindow(QMainWindow):
 
         self.setCentralWidget(main_widget)
 
+    def toggle_chunked(self, checked):
+        self.recentSetting.setValue(CHUNKED_TRACK,checked)
+        ProjectManager.CHUNKED = checked
+
+    def data_cache(self):
+        stats = gl.dataCache.getStats()
+        text = ('Hits: %(hits)d, Misses: %(misses)d, Evictions: %(evictions)d\n'
+            'Items: %(items)d, Used: %(bytes)d bytes\n\nBudget (MB):') % stats
+        budget, ok = QInputDialog.getInt(self, 'Data Cache', text,
+            stats['budget']>>20, 16, 1<<20)
+        if not ok: return
+
+        gl.dataCache.setBudget(budget<<20)
+        self.recentSetting.setValue(CACHE_BUDGET,budget<<20)
+
     def quit(self):
         self.close()
 
@@ -79,6 +106,7 @@ class MainWindow(QMainWindow):
         if not projFolder: return
 
         self.recentSetting.setValue(RECENT_PROJ,projFolder)
+        self.close_project()
         gl.projectManager = ProjectManager(projFolder)
 
     def open_project(self):
@@ -88,8 +116,17 @@ class MainWindow(QMainWindow):
         if not filename: return
 
         self.recentSetting.setValue(RECENT_PROJ,path.dirname(filename))
+        self.close_project()
         gl.projectManager = ProjectManager(filename)
 
+    def close_project(self):
+        if gl.projectManager is not None:
+            gl.projectManager.flush()
+
+    def closeEvent(self, event):
+        self.close_project()
+        super().closeEvent(event)
+
     def import_orosMat(self):
         if gl.projectManager is None:
             QMessageBox.warning(self, 'Import File', 'Open a project or create a new one first.')
@@ -103,6 +140,19 @@ class MainWindow(QMainWindow):
         self.recentSetting.setValue(RECEN_MAT,path.dirname(filename))
         gl.projectManager.importOrosMat(filename)
 
+    def import_orosMats(self):
+        if gl.projectManager is None:
+            QMessageBox.warning(self, 'Import File', 'Open a project or create a new one first.')
+            return
+
+        filenames = QFileDialog.getOpenFileNames(self, 'Import Oros Mat Files',
+            filter='Matlab File (*.mat);;All (*.*)',
+            directory=self.recentSetting.value(RECEN_MAT,''))
+        if not filenames: return
+
+        self.recentSetting.setValue(RECEN_MAT,path.dirname(filenames[0]))
+        gl.projectManager.importOrosMats(filenames)
+
 def progressTest(loi):
     # import time
 
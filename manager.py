@@ -1,17 +1,26 @@
-import os, sys, importlib
+import os, sys, importlib, shutil, gc
 from os import path, listdir
-import json, uuid
+import json, uuid, hashlib
+from contextlib import contextmanager
 from rdsp.module import ModuleType, SignalModule, TrackModule
-from scipy.io import loadmat
+from rdsp.importer import importOrosMat
+from rdsp import storage
+from rdsp.parallel import runTasks
 import numpy as np
 from rdsp import gl
+from PyQt4.QtCore import QTimer
 
 class ProjectManager(object):
     ListWidget = None
     DEFAULTCONFIG = 'project.json'
     RESULTDIR = 'result/'
     SOURCEDIR = 'source/'
+    CACHEDIR = 'cache/' # virtual tracks evaluated, can be deleted any time
     EXTENSION = '.npy'
+    RESULTMETA = 'meta.json'
+    MMAPMODE = 'r'
+    CHUNKED = False # new tracks in compressed chunks instead of .npy
+    SAVEDELAY = 0 # ms, >0 debounces saving of project.json
 
     @staticmethod
     def RegisterListWidget(listWidget):
@@ -19,6 +28,19 @@ class ProjectManager(object):
 
     def __init__(self, fdPath):
         self.signals = []
+        # guid -> signal/track/process, for lookups while loading
+        self.objects = {}
+        # signal guid -> serialized config, reused until marked dirty
+        self.fileConfigs = {}
+        self.dirty = set()
+        self.batchLevel = 0
+        self.pendingNodes = []
+        self.pendingSave = False
+        # path -> remove function, files still open when deleted
+        self.pendingRemovals = {}
+        self.saveTimer = QTimer()
+        self.saveTimer.setSingleShot(True)
+        self.saveTimer.timeout.connect(self.saveProject)
 
         if path.isdir(fdPath):
             # new project folder
@@ -44,99 +66,419 @@ class ProjectManager(object):
         self.configFile = configFile
         self.resultDir = resultDir
         self.sourceDir = sourceDir
+        self.cacheDir = path.join(path.dirname(configFile), ProjectManager.CACHEDIR)
         self.parseConfig(data)
-        self.refresh(False)
+        self.refresh(save=False)
 
     def importOrosMat(self, matpath):
-        # mat = loadmat(matpath)
+        # decode one track at a time and write it to source/ before the next
         def funcname(loi):
-            loi[2] = loadmat(matpath)
+            loi[2] = importOrosMat(matpath, self.sourceDir, loi, ProjectManager.CHUNKED)
 
-        mat = gl.progressManager.startNewProgress('Loading Mat',funcname,[0,0,0])
-        i = 1
-        tracks = []
-
-        while ('Track%d' % i) in mat:
-            i += 1
-        n = i-1
+        result = gl.progressManager.startNewProgress('Loading Mat',funcname,[0,0,0])
+        if result is None: return
+        (date, tracks) = result
         guid = str(uuid.uuid4())
         name = path.basename(matpath)
         signal = SignalModule(guid, name, self)
         self.signals.append(signal)
-
-        for i in np.arange(n)+1:
-            tracks.append({
-                'name':mat['Track%d_Name' % i][0],
-                'config':{
-                    'bandwidth':int(mat['Track%d_TrueBandWidth' % i][0,0]),
-                    'c1':float(mat['Track%d_Sensitivity' % i][0,0]),
-                    'c0':float(mat['Track%d_Offset' % i][0,0]),
-                    'x-unit':mat['Track%d_X_Magnitude' % i][0],
-                    'y-unit':mat['Track%d_Y_Magnitude' % i][0]
-                },
-                'data':mat['Track%d' % i]
-            })
+        self.register(signal)
 
         signal.parseConfig({
-            'date':mat['RecordDate'][0]
+            'date':date
         })
-        signal.addTracks(tracks)
+        # the signal is listed and saved even without a usable track
+        with self.batch():
+            signal.addTracks(tracks)
+            self.refresh(signal)
+
+    def importOrosMats(self, matpaths):
+        # one file per worker process, the config is saved once at the end
+        def funcname(loi):
+            loi[2] = runTasks(importOrosMat, [
+                (matpath, self.sourceDir, None, ProjectManager.CHUNKED) for matpath in matpaths
+            ], loi)
+
+        results = gl.progressManager.startNewProgress('Loading Mats',funcname,[len(matpaths),0,0])
+        if results is None: return
+        with self.batch():
+            for (matpath, (date, tracks)) in zip(matpaths, results):
+                signal = SignalModule(str(uuid.uuid4()), path.basename(matpath), self)
+                signal.parseConfig({
+                    'date':date
+                })
+                signal.fillTracks(tracks)
+                self.signals.append(signal)
+                self.register(signal)
+                self.refresh(signal)
 
     def importInternalSignal(self, intSig):
         pass
 
     def saveProject(self):
+        self.saveTimer.stop()
         with open(self.configFile, mode='w') as fp:
             json.dump(self.getFileConfig(), fp, indent=2)
 
+    def requestSave(self):
+        if ProjectManager.SAVEDELAY:
+            # restarting the timer folds a burst of changes into one save
+            self.saveTimer.start(ProjectManager.SAVEDELAY)
+        else:
+            self.saveProject()
+
+    def flush(self):
+        # write a debounced save now, e.g. before closing
+        if self.saveTimer.isActive():
+            self.saveProject()
+        self.retryRemovals()
+
+    def releaseFiles(self, values):
+        # values dropped from the cache, their file handles go with them
+        while values:
+            value = values.pop()
+            if isinstance(value, storage.ChunkedTrack):
+                value.close()
+        value = None
+        # unreferenced memmaps are unmapped when collected
+        gc.collect()
+
+    def removeFile(self, filePath, remove=os.remove):
+        try:
+            remove(filePath)
+        except PermissionError:
+            # still mapped elsewhere (Windows), tried again on flush
+            self.pendingRemovals[filePath] = remove
+
+    def retryRemovals(self):
+        pending = self.pendingRemovals
+        self.pendingRemovals = {}
+        gc.collect()
+        for (filePath, remove) in pending.items():
+            if path.exists(filePath):
+                self.removeFile(filePath, remove)
+
+    def saveNode(self, node):
+        # config of node changed but the list stays the same
+        self.markDirty(node)
+        if self.batchLevel:
+            self.pendingSave = True
+        else:
+            self.requestSave()
+
+    def markDirty(self, node=None):
+        # the signal holding node is serialized again, None for all
+        if node is None:
+            self.fileConfigs.clear()
+            return
+        while node.parent is not self:
+            node = node.parent
+        self.dirty.add(node.guid)
+
+    def beginBatch(self):
+        self.batchLevel += 1
+
+    def endBatch(self):
+        self.batchLevel -= 1
+        if self.batchLevel: return
+        nodes = self.pendingNodes
+        save = self.pendingSave
+        self.pendingNodes = []
+        self.pendingSave = False
+        if None in nodes:
+            self.updateList()
+        else:
+            for node in self.outermostNodes(nodes):
+                self.updateList(node)
+        if save: self.requestSave()
+
+    def outermostNodes(self, nodes):
+        # drop nodes whose ancestor will be rebuilt anyway
+        result = []
+        nodes = [node.parent if isinstance(node, TrackModule) else node for node in nodes]
+        for node in nodes:
+            if node in result: continue
+            parent = node.parent
+            while parent is not self and parent not in nodes:
+                parent = parent.parent
+            if parent is self:
+                result.append(node)
+        return result
+
+    @contextmanager
+    def batch(self):
+        '''
+        with projectManager.batch():
+            ...
+        refreshes and saves once, when the outermost batch ends
+        '''
+        self.beginBatch()
+        try:
+            yield self
+        finally:
+            self.endBatch()
+
     def parseConfig(self, data):
         # self.signals.clear()
         # it should be clear
         for dt in data:
             # assert dt['type'] == 'Signal'
             signal = SignalModule(dt['guid'], dt['name'], self)
+            self.register(signal)
             signal.fillTracks(dt['tracks'])
             signal.fillProcess(dt['process'])
             signal.parseConfig(dt['config'])
             self.signals.append(signal)
 
     def getFileConfig(self):
-        return [signal.getFileConfig() for signal in self.signals]
+        configs = []
+        for signal in self.signals:
+            if signal.guid in self.dirty or signal.guid not in self.fileConfigs:
+                self.fileConfigs[signal.guid] = signal.getFileConfig()
+            configs.append(self.fileConfigs[signal.guid])
+        self.dirty.clear()
+        return configs
+
+    def register(self, obj):
+        self.objects[obj.guid] = obj
+
+    def unregister(self, obj):
+        self.objects.pop(obj.guid, None)
+
+    def getTrack(self, guid):
+        obj = self.objects.get(guid)
+        return obj if isinstance(obj, TrackModule) else None
 
     def addTracks(self, tracks):
         for track in tracks:
-            np.save(path.join(self.sourceDir,track.guid+ProjectManager.EXTENSION),track.getData())
-        self.refresh()
+            # tracks from importer are written already
+            if track.dataLoaded:
+                self.saveTrack(track.guid, track.getData())
+                track.releaseData()
+            self.register(track)
+        if tracks: self.refresh(tracks[0])
 
     def removeTracks(self, tracks):
+        # virtual tracks that stay are stored before their source goes,
+        # nothing is removed if that is cancelled
+        removed = set(track.guid for track in tracks)
+        dependents = [
+            obj for obj in list(self.objects.values())
+            if (isinstance(obj, TrackModule) and obj.isVirtual()
+                and obj.guid not in removed and obj.recipe['source'] in removed)
+        ]
+        if not self.evaluateTracks(dependents):
+            return False
+        for track in dependents:
+            if not track.materialize():
+                return False
+        released = []
         for track in tracks:
-            os.remove(path.join(self.sourceDir,track.guid+ProjectManager.EXTENSION))
-        self.refresh()
+            released += gl.dataCache.removePrefix(('track',track.guid))
+        self.releaseFiles(released)
+        for track in tracks:
+            if track.isVirtual():
+                self.removeEvaluated(track.guid)
+            else:
+                self.removeFile(storage.findTrack(self.sourceDir, track.guid))
+            self.unregister(track)
+        if tracks: self.refresh(tracks[0])
+        return True
 
     def removeProcess(self, process):
         # in fact, process is SignalModule
         self.signals.remove(process)
-        self.refresh()
-
-    def refresh(self, save=True):
-        # TODO: refine for save
-        # will refresh many times when there's deletion
-        ProjectManager.ListWidget.clear()
+        self.unregister(process)
+        self.fileConfigs.pop(process.guid, None)
+        self.refresh(process)
+
+    def refresh(self, node=None, save=True):
+        # node is the module that changed, None for everything
+        if node is None:
+            if save: self.markDirty()
+        else:
+            self.markDirty(node)
+        if self.batchLevel:
+            # deferred to endBatch
+            self.pendingNodes.append(node)
+            self.pendingSave = self.pendingSave or save
+            return
+
+        self.updateList(node)
+        if save: self.requestSave()
+
+    def updateList(self, node=None):
+        # touch only the subtree of node, None rebuilds everything
+        listWidget = ProjectManager.ListWidget
+        if node is not None:
+            if isinstance(node, TrackModule):
+                # tracks are listed under their signal
+                node = node.parent
+            if node.parent is self:
+                siblings = self.signals
+            else:
+                siblings = getattr(node.parent, 'process', None)
+            if siblings is not None and node not in siblings:
+                listWidget.removeNode(node.guid)
+                return
+            config = node.getListConfig()
+            if listWidget.updateNode(config):
+                return
+            parentGuid = None if node.parent is self else node.parent.guid
+            if listWidget.insertNode(config, parentGuid):
+                return
+
+        listWidget.clear()
         for signal in self.signals:
-            ProjectManager.ListWidget.addNode(signal.getListConfig())
-        if save: self.saveProject()
+            listWidget.addNode(signal.getListConfig())
+
+    def saveTrack(self, guid, data):
+        storage.saveTrack(self.sourceDir, guid, data, ProjectManager.CHUNKED)
+
+    def getTrackSource(self, guid):
+        # picklable, for storage.openSource in worker processes
+        return (self.sourceDir, guid)
+
+    def getEvaluatedName(self, track):
+        # named after the stamp, a changed recipe or source is evaluated again
+        stamp = json.dumps(track.getStamp(), sort_keys=True)
+        return '%s-%s' % (track.guid, hashlib.sha1(stamp.encode()).hexdigest()[:16])
+
+    def isEvaluated(self, track):
+        return path.exists(storage.trackPath(self.cacheDir, self.getEvaluatedName(track)))
+
+    def getEvaluatedSource(self, track):
+        '''
+        Source of a derived track evaluated once into a plain file
+        under cache/. Processes call evaluateTracks first, so this
+        only evaluates for a plot or the like.
+        '''
+        if not self.isEvaluated(track) and not self.evaluateTracks([track]):
+            raise RuntimeError('%s was not evaluated' % track.name)
+        return (self.cacheDir, self.getEvaluatedName(track))
+
+    def evaluateTracks(self, tracks):
+        '''
+        Evaluate the derived tracks among tracks and the ones they
+        derive from, sources first, in the progress thread so the window
+        stays responsive. False if cancelled or failed.
+        '''
+        pending = []
+        def visit(track):
+            if not track.isVirtual(): return
+            visit(track.getSourceTrack())
+            if not track.isView() and track not in pending and not self.isEvaluated(track):
+                pending.append(track)
+        for track in tracks:
+            visit(track)
+        if not pending:
+            return True
 
-    def loadTrack(self, guid):
-        return np.load(path.join(self.sourceDir,guid+ProjectManager.EXTENSION))
+        def funcname(loi):
+            for track in pending:
+                if loi[3]: break
+                loi[4] = track.name
+                if not self.evaluateTrack(track, loi): break
+                loi[1] += 1
+            loi[2] = 1
+
+        loi = [len(pending),0,0,False,None]
+        gl.progressManager.startNewProgress('Evaluating',funcname,loi)
+        return not loi[3]
+
+    def evaluateTrack(self, track, loi=None):
+        # its source is evaluated already, see evaluateTracks
+        name = self.getEvaluatedName(track)
+        self.removeEvaluated(track.guid)
+        os.makedirs(self.cacheDir, exist_ok=True)
+        r = track.recipe
+        # renamed when complete, an interrupted one is not reused
+        work = name+'-work'
+        try:
+            if not storage.evaluateSource((storage.RECIPE, track.getSourceTrack().getSource(),
+                    r['op'], r['params']), (self.cacheDir, work), loi):
+                return False
+            os.replace(storage.trackPath(self.cacheDir, work), storage.trackPath(self.cacheDir, name))
+        finally:
+            if path.exists(storage.trackPath(self.cacheDir, work)):
+                os.remove(storage.trackPath(self.cacheDir, work))
+        return True
+
+    def removeEvaluated(self, guid):
+        # evaluations of a virtual track and their cached data
+        self.releaseFiles(gl.dataCache.removePrefix(('track',guid)))
+        if path.isdir(self.cacheDir):
+            for f in listdir(self.cacheDir):
+                if f.startswith(guid):
+                    self.removeFile(path.join(self.cacheDir, f))
+
+    def getTrackStamp(self, guid):
+        return storage.getStamp(self.sourceDir, guid)
+
+    def loadTrack(self, guid, mmap=True):
+        # mmap keeps the track on disk, only the touched samples are paged in
+        mmapMode = ProjectManager.MMAPMODE if mmap else None
+        return storage.loadTrack(self.sourceDir, guid, mmapMode)
 
     def loadResult(self, guid):
-        return np.load(path.join(self.resultDir,guid+ProjectManager.EXTENSION))
+        # results of this form are pickled lists/dicts
+        return np.load(path.join(self.resultDir,guid+ProjectManager.EXTENSION),allow_pickle=True)
 
     def saveResult(self, guid, result):
         np.save(path.join(self.resultDir,guid+ProjectManager.EXTENSION),result)
 
+    def removeLegacyResult(self, guid):
+        # the pickled file once its content is moved to result/<guid>/
+        resultFile = path.join(self.resultDir,guid+ProjectManager.EXTENSION)
+        if path.exists(resultFile):
+            os.remove(resultFile)
+
     def removeResult(self, guid):
-        os.remove(path.join(self.resultDir,guid+ProjectManager.EXTENSION))
+        self.releaseFiles(gl.dataCache.removePrefix(('result',guid)))
+        resultDir = path.join(self.resultDir,guid)
+        resultFile = path.join(self.resultDir,guid+ProjectManager.EXTENSION)
+        if path.isdir(resultDir):
+            self.removeFile(resultDir, shutil.rmtree)
+        elif path.exists(resultFile):
+            self.removeFile(resultFile)
+
+    # array results, one plain .npy per key under result/<guid>/,
+    # described by result/<guid>/meta.json
+
+    def getResultDir(self, guid):
+        resultDir = path.join(self.resultDir,guid)
+        # written again, the old files left are overwritten instead
+        self.pendingRemovals.pop(resultDir, None)
+        if not path.isdir(resultDir):
+            os.mkdir(resultDir)
+        return resultDir
+
+    def getResultPath(self, guid, key):
+        return path.join(self.getResultDir(guid),key+ProjectManager.EXTENSION)
+
+    def saveResultArray(self, guid, key, array):
+        np.save(self.getResultPath(guid,key),array)
+
+    def createResultArray(self, guid, key, shape, dtype):
+        # writable memmap of a new .npy, to be filled block by block
+        return np.lib.format.open_memmap(self.getResultPath(guid,key),
+            mode='w+',dtype=dtype,shape=shape)
+
+    def loadResultArray(self, guid, key, mmap=True):
+        mmapMode = ProjectManager.MMAPMODE if mmap else None
+        return np.load(self.getResultPath(guid,key),mmap_mode=mmapMode)
+
+    def saveResultMeta(self, guid, meta):
+        with open(path.join(self.getResultDir(guid),ProjectManager.RESULTMETA), mode='w') as fp:
+            json.dump(meta, fp, indent=2)
+
+    def loadResultMeta(self, guid):
+        # None for results saved by saveResult
+        metaFile = path.join(self.resultDir,guid,ProjectManager.RESULTMETA)
+        if not path.exists(metaFile):
+            return None
+        with open(metaFile) as fp:
+            return json.load(fp)
 
 class ModuleManager(object):
     def __init__(self, mdPath):
@@ -178,32 +520,69 @@ from threading import Thread
 from PyQt4 import QtGui
 import time
 class ProgressManager(object):
-    def __init__(self, statusBar, progressBar):
+    def __init__(self, statusBar, progressBar, cancelButton=None):
         self.statusBar = statusBar
         self.progressBar = progressBar
+        self.cancelButton = cancelButton
+        self.loi = None
+        if cancelButton is not None:
+            cancelButton.clicked.connect(self.cancel)
 
     def startNewProgress(self, text, func, loi):
-        # loi [count,current,finished]
+        # loi [count,current,finished(,cancelled(,message))]
+        # with the 4th item func should stop once it is True
         self.statusBar.showMessage(text,0)
         self.progressBar.reset()
         self.progressBar.setVisible(True)
-        thread = Thread(target=func, args=(loi,))
+        self.loi = loi
+        cancelable = len(loi)>3 and self.cancelButton is not None
+        if cancelable:
+            self.cancelButton.setEnabled(True)
+            self.cancelButton.setVisible(True)
+        message = None
+        errors = []
+        def run(loi):
+            # an exception ends the progress instead of leaving loi[2] unset
+            try:
+                func(loi)
+            except Exception as e:
+                errors.append(e)
+                if len(loi)>3: loi[3] = True
+        thread = Thread(target=run, args=(loi,))
         thread.start()
-        while not loi[2]:
+        while thread.is_alive():
             if loi[0]:
                 i = int(100*loi[1]/loi[0])
             else:
                 i = self.progressBar.value()+5
                 if i>100: i=0
 
+            if len(loi)>4 and loi[4]!=message:
+                message = loi[4]
+                self.statusBar.showMessage('%s - %s' % (text,message),0)
             self.progressBar.setValue(i)
             QtGui.qApp.processEvents()
             time.sleep(0.1)
         thread.join()
+        if cancelable:
+            self.cancelButton.setVisible(False)
+        self.loi = None
         self.statusBar.clearMessage()
         self.progressBar.setVisible(False)
+        if errors:
+            # reported as cancelled when loi has the flag, else None
+            QtGui.QMessageBox.warning(None,text,'%s failed: %s' % (text,errors[0]))
+            return None
         return loi[2]
 
+    def cancel(self):
+        if self.loi is not None and len(self.loi)>3:
+            self.loi[3] = True
+            self.cancelButton.setEnabled(False)
+
+    def showMessage(self, text, timeout=3000):
+        self.statusBar.showMessage(text,timeout)
+
 from guiqwt.plot import PlotManager as pltMng
 from rdsp.widgets import TrackWidget
 import guiqwt.tools as tl
@@ -1,7 +1,7 @@
 from enum import IntEnum
-from rdsp import gl
+from rdsp import gl, storage
 from PyQt4 import QtGui
-import uuid, numpy as np
+import uuid, json, hashlib, numpy as np
 
 class ModuleType(IntEnum):
     none = 0
@@ -12,6 +12,7 @@ class ModuleType(IntEnum):
 class ModuleBase(object):
     ModuleName = 'ModuleName'
     ModuleType = ModuleType.all
+    ModuleVersion = 1 # increase when processNow gives different results
     ContextMenu = []
 
     def __init__(self, guid, name, parent):
@@ -19,6 +20,15 @@ class ModuleBase(object):
         self.name = name
         self.parent = parent
         self.config = {}
+        self.fingerprint = None # of the inputs that made the saved result
+
+    def getFingerprint(self, config, tracks):
+        # same config, module version and input tracks -> same result
+        h = hashlib.sha1()
+        h.update(json.dumps([self.ModuleName,self.ModuleVersion,config], sort_keys=True).encode())
+        for track in tracks:
+            h.update(json.dumps([track.guid,track.getStamp()]).encode())
+        return h.hexdigest()
 
     def configWindow(self, config=None):
         raise NotImplementedError
@@ -58,13 +68,21 @@ class SignalContainer(ModuleBase):
 
     def getTrack(self, guid):
         # even though track may in self.tracks
+        # resolved by the guid index of ProjectManager
         return self.parent.getTrack(guid)
 
+    def register(self, obj):
+        self.parent.register(obj)
+
+    def unregister(self, obj):
+        self.parent.unregister(obj)
+
     def getTracksList(self):
         # TODO: cache to avoid loop
         return [{
             'name':track.name,
-            'guid':track.guid
+            'guid':track.guid,
+            'sr':track.getSampleRate()
         } for track in self.tracks]
 
     def addTracks(self, tracksConfig):
@@ -74,9 +92,12 @@ class SignalContainer(ModuleBase):
 
     def removeTracks(self, tracks):
         # assert tracks!=self.tracks
-        for track in tracks:
-            self.tracks.remove(track)
-        self.parent.removeTracks(tracks)
+        with gl.projectManager.batch():
+            if not self.parent.removeTracks(tracks):
+                return False
+            for track in tracks:
+                self.tracks.remove(track)
+        return True
 
     def addProcess(self):
         moduleName = gl.moduleManager.getModulesName()
@@ -87,7 +108,8 @@ class SignalContainer(ModuleBase):
             module = moduleClass(guid, item, self)
             if module.configWindow():
                 self.process.append(module)
-                self.parent.refresh()
+                self.register(module)
+                self.refresh(module)
 
     def fillProcess(self, processConfig):
         for pc in processConfig:
@@ -100,11 +122,15 @@ class SignalContainer(ModuleBase):
             else:
                 prc = moduleClass(pc['guid'], pc['name'], self)
             prc.parseConfig(pc['config'])
+            if 'fingerprint' in pc:
+                prc.fingerprint = pc['fingerprint']
             self.process.append(prc)
+            self.register(prc)
 
     def removeProcess(self, process):
         self.process.remove(process)
-        self.parent.refresh()
+        self.unregister(process)
+        self.refresh(process)
 
     def getListConfig(self):
         return {
@@ -146,16 +172,20 @@ class SignalContainer(ModuleBase):
         ]
         self.fillProcess(config['process'])
 
-    def refresh(self):
-        self.parent.refresh()
+    def refresh(self, node=None):
+        self.parent.refresh(node or self)
 
     def delete(self):
-        for prc in self.process:
-            prc.delete()
-        # self.process.clear()
-        self.parent.removeTracks(self.tracks)
-        # self.tracks.clear()
-        self.parent.removeProcess(self)
+        # one refresh and one save for the whole removal
+        with gl.projectManager.batch():
+            # kept if storing the tracks derived from these is cancelled
+            if not self.parent.removeTracks(self.tracks):
+                return
+            # self.tracks.clear()
+            for prc in list(self.process):
+                prc.delete()
+            # self.process.clear()
+            self.parent.removeProcess(self)
 
 class SignalModule(SignalContainer):
     ModuleName = 'Signal'
@@ -163,9 +193,10 @@ class SignalModule(SignalContainer):
 
     def fillTracks(self, tracksConfig):
         for tc in tracksConfig:
-            track = TrackModule(tc['guid'], tc['name'], self)
+            track = TrackModule(tc['guid'], tc['name'], self, recipe=tc.get('recipe'))
             track.parseConfig(tc['config'])
             self.tracks.append(track)
+            self.register(track)
 
     def getFileConfig(self):
         return {
@@ -181,18 +212,13 @@ class SignalModule(SignalContainer):
             ]
         }
 
-    def getTrack(self, guid):
-        # TODO: do some cache to avoid loop
-        for track in self.tracks:
-            if track.guid == guid:
-                return track
-        return None
-
     def addTracks(self, tracksConfig):
         tracks = []
         for tc in tracksConfig:
-            guid = str(uuid.uuid4())
-            track = TrackModule(guid, tc['name'], self, tc['data'])
+            # 'guid' without 'data' means the track is stored already,
+            # 'recipe' without 'data' a virtual track derived from another
+            guid = tc['guid'] if 'guid' in tc else str(uuid.uuid4())
+            track = TrackModule(guid, tc['name'], self, tc.get('data'), tc.get('recipe'))
             track.parseConfig(tc['config'])
             tracks.append(track)
 
@@ -209,19 +235,101 @@ class TrackModule(ModuleBase):
 
     ContextMenu = [
         {'title':'Plot', 'action':'plot'},
-        {'title':'Add2Plot', 'action':'add2Plot'}
+        {'title':'Add2Plot', 'action':'add2Plot'},
+        {'title':'Materialize', 'action':'materialize'}
     ]
 
-    def __init__(self, guid, name, parent, data=None):
+    def __init__(self, guid, name, parent, data=None, recipe=None):
         super().__init__(guid,name,parent)
+        # data is only held until it is saved to the project
         self.data = data
         self.dataLoaded = data is not None
-
-    def getData(self):
-        if not self.dataLoaded:
-            self.data = gl.projectManager.loadTrack(self.guid)
-            self.dataLoaded = True
-        return self.data
+        # {'source','op','params'} of a virtual track, nothing is stored
+        # and the data is evaluated from the source track when asked,
+        # {'source','offset','length'} of a view on samples of the source
+        self.recipe = recipe
+
+    def getData(self, start=None, stop=None):
+        # data is (1,N), memory-mapped when loaded from project
+        # start/stop are sample indices, only that range will be read
+        if self.dataLoaded:
+            data = self.data
+        elif self.isView():
+            # nothing copied, a window of the source's (memory-mapped) data
+            r = self.recipe
+            (start, stop, step) = slice(start,stop).indices(r['length'])
+            return self.getSourceTrack().getData(r['offset']+start, r['offset']+stop)
+        elif self.recipe is not None:
+            # evaluated once into a file, see ProjectManager.getEvaluatedSource
+            source = self.getSource()
+            data = gl.dataCache.get(('track',self.guid,source[1]),
+                lambda: storage.openSource(source))
+        else:
+            data = gl.dataCache.get(('track',self.guid),
+                lambda: gl.projectManager.loadTrack(self.guid))
+        if start is None and stop is None:
+            return data
+        return data[:,start:stop]
+
+    def releaseData(self):
+        # saved, from now on loaded through the cache
+        self.data = None
+        self.dataLoaded = False
+
+    def getSize(self):
+        if self.isView():
+            return self.recipe['length']
+        if self.recipe is not None:
+            # operations keep the length, nothing is evaluated for it
+            return self.getSourceTrack().getSize()
+        return self.getData().shape[-1]
+
+    def isVirtual(self):
+        return self.recipe is not None
+
+    def isView(self):
+        return self.recipe is not None and 'offset' in self.recipe
+
+    def getSourceTrack(self):
+        return self.parent.getTrack(self.recipe['source'])
+
+    def materialize(self):
+        # store the evaluated data, the track is a plain one from now on
+        if self.recipe is None:
+            gl.progressManager.showMessage('%s is stored already' % self.name)
+            return True
+        if not gl.projectManager.evaluateTracks([self]):
+            return False
+        # copied from the evaluated file, block by block when chunked
+        data = self.getData()
+        def funcname(loi):
+            gl.projectManager.saveTrack(self.guid, data)
+            loi[2] = 1
+        if not gl.progressManager.startNewProgress('Storing %s' % self.name,funcname,[0,0,0]):
+            return False
+        data = None
+        gl.projectManager.removeEvaluated(self.guid)
+        self.recipe = None
+        gl.projectManager.saveNode(self)
+        return True
+
+    def getStamp(self):
+        if self.recipe is not None:
+            # changes with the recipe or with the source track
+            return [self.recipe, self.getSourceTrack().getStamp()]
+        return gl.projectManager.getTrackStamp(self.guid)
+
+    def getSource(self):
+        if self.isView():
+            r = self.recipe
+            return (storage.VIEW, self.getSourceTrack().getSource(), r['offset'], r['length'])
+        if self.recipe is not None:
+            # a plain file, the pool tasks do not evaluate the recipe again
+            return gl.projectManager.getEvaluatedSource(self)
+        return gl.projectManager.getTrackSource(self.guid)
+
+    def getSampleRate(self):
+        return self.config['bandwidth']*2.56
 
     def getListConfig(self):
         return {
@@ -234,21 +342,25 @@ class TrackModule(ModuleBase):
         # but to custom the display, such as KeyPhasor, use a dict
 
     def getFileConfig(self):
-        return {
+        config = {
             'type':self.ModuleName,
             'guid':self.guid,
             'name':self.name,
             'config':self.config
         }
+        if self.recipe is not None:
+            config['recipe'] = self.recipe
+        return config
 
     def parseConfig(self, config):
         self.config = config
 
-    def getPlotData(self):
-        data = self.getData()
-        l = data.size / (self.config['bandwidth']*2.56)
-        xs = np.linspace(0,l,data.size,False)
-        return (xs,data[0])
+    def getPlotData(self, start=None, stop=None):
+        n = self.getSize()
+        start, stop, step = slice(start,stop).indices(n)
+        sr = self.getSampleRate()
+        xs = np.arange(start,stop)/sr
+        return (xs,self.getData(start,stop)[0])
 
     def plot(self):
         x,y = self.getPlotData()
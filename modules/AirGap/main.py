@@ -11,6 +11,7 @@ class AirGapModule(ModuleBase):
     ContextMenu = [
         {'title':'Config', 'action':'setConfig'},
         {'title':'Process', 'action':'processNow'},
+        {'title':'Force Process', 'action':'processForce'},
         {'title':'Show Result', 'action':'showResult'},
         {'title':'Export', 'action':'export2xlsx'},
         {'title':'Delete', 'action':'delete'}
@@ -25,15 +26,11 @@ class AirGapModule(ModuleBase):
             'num-cw':False,
             'numOfPoles':48,
         }
-        self.result = None
-        self.resultLoaded = False
         self.processed = processed
 
     def getResult(self):
-        if not self.resultLoaded:
-            self.result = gl.projectManager.loadResult(self.guid)
-            self.resultLoaded = True
-        return self.result
+        return gl.dataCache.get(('result',self.guid),
+            lambda: gl.projectManager.loadResult(self.guid))
     
     def configWindow(self, config=None):
         if not config:
@@ -84,7 +81,8 @@ class AirGapModule(ModuleBase):
             'guid':self.guid,
             'name':self.name,
             'config':{},
-            'processed':self.processed
+            'processed':self.processed,
+            'fingerprint':self.fingerprint
         }
         cfg = config['config']
         cfg['rot-cw'] = self.config['rot-cw']
@@ -118,7 +116,17 @@ class AirGapModule(ModuleBase):
 
         return config
 
-    def processNow(self):
+    def processForce(self):
+        self.processNow(True)
+
+    def processNow(self, force=False):
+        cfg = self.getFileConfig()['config']
+        fingerprint = self.getFingerprint(cfg,
+            [self.keyPhasor]+[trackSet['object'] for trackSet in self.tracks])
+        if self.processed and not force and fingerprint==self.fingerprint:
+            gl.progressManager.showMessage('%s: result is up to date' % self.name)
+            return
+
         kp_data = self.keyPhasor.getData()[0]
         kp_data_bool = kp_data<((kp_data.max()+kp_data.min())/2)
         kp_se_pairs = findContinuous(kp_data_bool,0)
@@ -165,15 +173,16 @@ class AirGapModule(ModuleBase):
                 result.append(r)
                 loi[1] += 1
             gl.projectManager.saveResult(self.guid, result)
-            self.result = np.array(result)
+            gl.dataCache.put(('result',self.guid), np.array(result))
             loi[2] = 1
-        gl.progressManager.startNewProgress('Calculating',funcname,[len(self.tracks),0,0])
+        if not gl.progressManager.startNewProgress('Calculating',funcname,[len(self.tracks),0,0]):
+            return
 
         self.processed = True
-        self.resultLoaded = True
+        self.fingerprint = fingerprint
 
         # make sure processed=True
-        gl.projectManager.saveProject()
+        gl.projectManager.saveNode(self)
 
     def setConfig(self):
         config = self.getFileConfig()
@@ -181,7 +190,7 @@ class AirGapModule(ModuleBase):
         cfg['name'] = self.name
         cfg['trackSrc'] = self.parent.getTracksList()
         if self.configWindow(cfg):
-            self.parent.refresh()
+            self.parent.refresh(self)
 
     def showResult(self):
         if self.processed:
@@ -196,7 +205,8 @@ class AirGapModule(ModuleBase):
                 return
 
             result = self.getResult()
-            wb = xlsxwriter.Workbook(filename)
+            # rows are written in order, so nothing is kept in memory
+            wb = xlsxwriter.Workbook(filename, {'constant_memory':True})
             num_format = wb.add_format({'num_format':'0.000'})
             for dt in result:
                 ws = wb.add_worksheet(dt['name'])
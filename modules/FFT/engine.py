@@ -0,0 +1,330 @@
+import os
+import numpy as np
+from scipy import signal
+from rdsp import storage
+try:
+    # plan cache and float32 transforms, numpy.fft always gives complex128
+    from scipy import fft as fftpack
+except ImportError:
+    fftpack = np.fft
+
+WINDOWS = ('hanning','hamming','blackman','flattop','rectangular')
+BLOCKSIZE = 1<<22 # samples held per block when streaming
+ROWBLOCK = 1<<22 # values read at once from a stored STFT
+TASKBLOCKS = 8 # blocks per worker task
+AVERAGES = ('none','linear','rms','exponential','peak')
+EXPFRAMES = 10 # time constant of exponential average, in frames
+
+PRECISIONS = {
+    'double':(np.float64,np.complex128),
+    'single':(np.float32,np.complex64)
+}
+
+_windows = {}
+def getWindow(Nw, window='hanning', precision='double'):
+    '''
+    Symmetric window scaled by 2/sum(win),
+    so the half spectrum reads as amplitude without further scaling
+    '''
+    key = (Nw, window, precision)
+    if key not in _windows:
+        if window=='hanning':
+            win = np.hanning(Nw)
+        elif window=='hamming':
+            win = np.hamming(Nw)
+        elif window=='blackman':
+            win = np.blackman(Nw)
+        elif window=='flattop':
+            win = signal.windows.flattop(Nw)
+        else:
+            win = np.ones(Nw)
+        win = win*2/win.sum()
+        _windows[key] = win.astype(PRECISIONS[precision][0])
+    return _windows[key]
+
+class STFTEngine(object):
+    '''
+    Real-input STFT of a 1-D track,
+    each row of the result is a frame, Nw/2 lines as in the saved results
+    '''
+    def __init__(self, lines, overlap, window='hanning', precision='double'):
+        self.Nw = int(lines*2.56)
+        self.ols = max(1,int(self.Nw*(1-overlap/100))) # OverLapStep
+        self.width = self.Nw//2 # lines kept per frame
+        self.window = getWindow(self.Nw, window, precision)
+        (self.dtype, self.ctype) = PRECISIONS[precision]
+
+    def getAxes(self, sr):
+        # (t0, dt, f0, df), time of frame centres and frequency of lines
+        return (self.Nw/2/sr, self.ols/sr, 0.0, sr/self.Nw)
+
+    def getFrameCount(self, N):
+        # OverLapTimes
+        return max(0,(N-self.Nw)//self.ols+1)
+
+    def getFrames(self, data):
+        # (..., N) to (..., olt, Nw), several tracks share the segmentation
+        olt = self.getFrameCount(data.shape[-1])
+        stride = data.strides[-1]
+        return np.lib.stride_tricks.as_strided(data, shape=data.shape[:-1]+(olt,self.Nw),
+            strides=data.strides[:-1]+(stride*self.ols,stride))
+
+    def getBlocks(self, N, blockSize=BLOCKSIZE, first=0, last=None):
+        '''
+        (first frame, end frame, first sample, end sample) of each block
+        in frames [first, last), neighbouring blocks overlap by Nw-ols samples
+        '''
+        olt = self.getFrameCount(N)
+        if last is None or last>olt: last = olt
+        blockFrames = max(1,blockSize//self.Nw)
+        for f0 in range(first,last,blockFrames):
+            f1 = min(last,f0+blockFrames)
+            yield (f0, f1, f0*self.ols, (f1-1)*self.ols+self.Nw)
+
+    def getTasks(self, N, blockSize=BLOCKSIZE):
+        # frame ranges for the worker pool, a long track is split too
+        taskFrames = TASKBLOCKS*max(1,blockSize//self.Nw)
+        olt = self.getFrameCount(N)
+        return [(f0, min(olt,f0+taskFrames)) for f0 in range(0,olt,taskFrames)]
+
+    def process(self, read, N, out, blockSize=BLOCKSIZE, first=0, last=None, averager=None):
+        '''
+        Stream a track of N samples into out (olt, Nw/2) block by block,
+        read(start, stop) returns the 1-D samples in [start, stop).
+        out may be None when only the averager is wanted.
+        Peak memory depends on blockSize only.
+        '''
+        for (f0, f1, s0, s1) in self.getBlocks(N, blockSize, first, last):
+            spectra = self.transform(read(s0,s1))
+            if out is not None:
+                out[f0:f1] = spectra
+            if averager is not None:
+                averager.add(spectra)
+
+    def transform(self, data):
+        # copy in working precision, the strided view shares the track memory
+        frames = np.array(self.getFrames(data), dtype=self.dtype)
+        frames -= frames.mean(axis=-1, keepdims=True)
+        frames *= self.window
+        spectra = fftpack.rfft(frames, axis=-1)[...,:self.width]
+        return spectra.astype(self.ctype, copy=False)
+
+def checkBand(band, sr):
+    # zoom band (fLow, fHigh) in Hz, raises ValueError unless 0<=fLow<fHigh<=sr/2
+    (fLow, fHigh) = band
+    if not 0<=fLow<fHigh:
+        raise ValueError('zoom band %g-%g Hz is empty' % (fLow, fHigh))
+    if fHigh>sr/2:
+        raise ValueError('zoom band %g-%g Hz is above Nyquist (%g Hz)' % (fLow, fHigh, sr/2))
+
+class ZoomEngine(STFTEngine):
+    '''
+    Band-limited STFT: the band centre is mixed down to 0 Hz,
+    low-passed and decimated, then only the band is transformed.
+    lines are spread over the band instead of 0..bandwidth.
+    '''
+    def __init__(self, lines, overlap, window, precision, band, sr):
+        (fLow, fHigh) = band
+        checkBand(band, sr)
+        span = fHigh-fLow
+        self.fc = (fLow+fHigh)/2
+        self.srIn = sr
+        self.D = max(1,int(sr/(1.28*span))) # decimation, complex needs 1.28*span
+        self.sr = sr/self.D
+        self.Nw = int(round(self.sr*lines/span))
+        self.ols = max(1,int(self.Nw*(1-overlap/100)))
+        self.width = lines
+        self.window = getWindow(self.Nw, window, precision)
+        (self.dtype, self.ctype) = PRECISIONS[precision]
+        # anti-alias, passes the band, stops before the first alias,
+        # also without decimation it removes the image of the negative side
+        self.sos = signal.ellip(8, 0.1, 80, 0.51*span/(sr/2), output='sos')
+
+    def getAxes(self, sr=None):
+        df = self.sr/self.Nw
+        return (self.Nw/2/self.sr, self.ols/self.sr, self.fc-(self.width//2)*df, df)
+
+    def getBasebandSize(self, N):
+        return (N+self.D-1)//self.D
+
+    def baseband(self, read, N, out, blockSize=BLOCKSIZE):
+        # mix, filter and decimate block by block, filter state carried over
+        zi = None
+        pos = 0
+        for s0 in range(0,N,blockSize):
+            s1 = min(N,s0+blockSize)
+            n = np.arange(s0,s1)
+            x = read(s0,s1)*np.exp(-2j*np.pi*self.fc/self.srIn*n)
+            if zi is None:
+                zi = signal.sosfilt_zi(self.sos)*x[0]
+            (x, zi) = signal.sosfilt(self.sos, x, zi=zi)
+            x = x[(-s0)%self.D::self.D]
+            out[pos:pos+x.size] = x
+            pos += x.size
+
+    def transform(self, data):
+        # complex frames, the mean is the band centre and stays
+        frames = np.array(self.getFrames(data), dtype=self.ctype)
+        frames *= self.window
+        spectra = fftpack.fftshift(fftpack.fft(frames, axis=-1), axes=-1)
+        first = self.Nw//2-self.width//2
+        return spectra[...,first:first+self.width].astype(self.ctype, copy=False)
+
+class Averager(object):
+    '''
+    Averaged amplitude spectrum accumulated frame by frame,
+    partial averagers of consecutive frame ranges can be merged in order
+    '''
+    def __init__(self, mode, lines, expFrames=EXPFRAMES):
+        self.mode = mode
+        self.alpha = 1/expFrames
+        self.count = 0
+        self.acc = np.zeros(lines)
+
+    def add(self, spectra):
+        amp = np.abs(spectra)
+        m = amp.shape[0]
+        if not m: return
+        if self.mode=='linear':
+            self.acc += amp.sum(axis=0)
+        elif self.mode=='rms':
+            self.acc += (amp**2).sum(axis=0)
+        elif self.mode=='peak':
+            np.maximum(self.acc, amp.max(axis=0), out=self.acc)
+        else:
+            # exponential on power, A = (1-a)*A + a*p for every frame at once
+            decay = 1-self.alpha
+            weights = self.alpha*decay**np.arange(m-1,-1,-1)
+            self.acc = decay**m*self.acc + weights.dot(amp**2)
+        self.count += m
+
+    def merge(self, later):
+        if self.mode=='peak':
+            np.maximum(self.acc, later.acc, out=self.acc)
+        elif self.mode=='exponential':
+            self.acc = (1-self.alpha)**later.count*self.acc + later.acc
+        else:
+            self.acc += later.acc
+        self.count += later.count
+
+    def getResult(self):
+        if not self.count:
+            return self.acc
+        if self.mode=='linear':
+            return self.acc/self.count
+        if self.mode=='rms':
+            return np.sqrt(self.acc/self.count)
+        if self.mode=='peak':
+            return self.acc
+        # started from zero, remove that bias
+        return np.sqrt(self.acc/(1-(1-self.alpha)**self.count))
+
+def processFrames(source, resultPath, params, first, last, average='none'):
+    '''
+    Worker task: frames [first, last) of the track at source
+    into the result file made by ProjectManager.createResultArray,
+    resultPath None to keep nothing but the returned Averager
+    '''
+    engine = STFTEngine(*params)
+    data = storage.openSource(source)
+    out = None if resultPath is None else np.load(resultPath, mmap_mode='r+')
+    averager = None if average=='none' else Averager(average, engine.width)
+    engine.process(lambda start, stop: data[0,start:stop], data.shape[-1], out,
+        first=first, last=last, averager=averager)
+    if out is not None:
+        out.flush()
+    return averager
+
+def processZoom(source, resultPath, params, band, sr, average, workPath):
+    '''
+    Worker task: zoom STFT of a whole track, the filter state
+    makes it sequential so tracks are the unit of parallel work.
+    The decimated baseband goes through workPath and is removed after.
+    '''
+    engine = ZoomEngine(*(params+(band, sr)))
+    data = storage.openSource(source)
+    N = data.shape[-1]
+    bb = np.lib.format.open_memmap(workPath, mode='w+',
+        dtype=engine.ctype, shape=(engine.getBasebandSize(N),))
+    engine.baseband(lambda start, stop: data[0,start:stop], N, bb)
+
+    out = None if resultPath is None else np.load(resultPath, mmap_mode='r+')
+    averager = None if average=='none' else Averager(average, engine.width)
+    engine.process(lambda start, stop: bb[start:stop], bb.size, out, averager=averager)
+    if out is not None:
+        out.flush()
+    del bb
+    os.remove(workPath)
+    return averager
+
+def runTask(func, *args):
+    # one pool for both kinds of task
+    return func(*args)
+
+PEAKDTYPE = np.dtype([('frame',np.int32),('freq',np.float64),('amp',np.float32),('phase',np.float32)])
+
+def findPeaks(spectra, count, grid, first=0, threshold=0):
+    '''
+    Local maxima of the amplitude in every row of spectra (frames, lines),
+    at most count per frame, as PEAKDTYPE records.
+    grid (f0, df) places the lines, the frequency is refined by a parabola
+    through the peak and its neighbours.
+    '''
+    (f0, df) = grid
+    amp = np.abs(spectra)
+    (m, w) = amp.shape
+    if w<3 or not m:
+        return np.zeros(0, dtype=PEAKDTYPE)
+    mid = amp[:,1:-1]
+    isPeak = (mid>amp[:,:-2]) & (mid>=amp[:,2:]) & (mid>threshold)
+    score = np.where(isPeak, mid, -1)
+    if count<score.shape[1]:
+        # the count highest of each frame, unordered
+        cols = np.argpartition(score, -count, axis=1)[:,-count:]
+    else:
+        cols = np.broadcast_to(np.arange(score.shape[1]), score.shape)
+    rows = np.broadcast_to(np.arange(m)[:,None], cols.shape)
+    keep = score[rows,cols]>0
+    (rows, cols) = (rows[keep], cols[keep]+1)
+
+    (a, b, c) = (amp[rows,cols-1], amp[rows,cols], amp[rows,cols+1])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        delta = np.nan_to_num(0.5*(a-c)/(a-2*b+c))
+    peaks = np.empty(rows.size, dtype=PEAKDTYPE)
+    peaks['frame'] = rows+first
+    peaks['freq'] = f0+(cols+np.clip(delta,-0.5,0.5))*df
+    peaks['amp'] = b
+    peaks['phase'] = np.angle(spectra[rows,cols])
+    order = np.lexsort((peaks['freq'],peaks['frame']))
+    return peaks[order]
+
+def extractPeaks(resultPath, first, last, count, grid, rowBlock=ROWBLOCK):
+    # worker task: peaks of rows [first, last) of a stored STFT
+    data = np.load(resultPath, mmap_mode='r')
+    step = max(1,rowBlock//data.shape[1])
+    tables = [
+        findPeaks(data[i:min(last,i+step)], count, grid, i)
+        for i in range(first,last,step)
+    ]
+    return np.concatenate(tables) if tables else np.zeros(0, dtype=PEAKDTYPE)
+
+def getOrderTrack(peaks, frames, speed, order, tolerance):
+    '''
+    Amplitude of the order of speed (Hz per frame) over frames,
+    the highest peak within tolerance (Hz) of order*speed, 0 if none
+    '''
+    amp = np.zeros(frames)
+    target = order*speed[peaks['frame']]
+    near = np.abs(peaks['freq']-target)<=tolerance
+    np.maximum.at(amp, peaks['frame'][near], peaks['amp'][near])
+    return amp
+
+def getRunningSpeed(peaks, frames, band):
+    # frequency of the highest peak in band of every frame, nan if none
+    (fLow, fHigh) = band
+    inBand = peaks[(peaks['freq']>=fLow) & (peaks['freq']<=fHigh)]
+    speed = np.full(frames, np.nan)
+    # sorted by amplitude, the last write of each frame wins
+    inBand = inBand[np.argsort(inBand['amp'], kind='stable')]
+    speed[inBand['frame']] = inBand['freq']
+    return speed
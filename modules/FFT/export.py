@@ -0,0 +1,74 @@
+import csv
+import numpy as np
+from rdsp.modules.FFT.engine import ROWBLOCK
+
+# spectra are written row block by row block,
+# only one block of amplitudes is in memory whatever the result size.
+# A quarter of ROWBLOCK, xlsx turns a block into python floats (~32 bytes each)
+EXPORTBLOCK = ROWBLOCK>>2
+XLSXMAXROWS = 1048576
+XLSXMAXCOLS = 16384
+
+def getBlocks(z, r0, r1, c0, c1, loi=None):
+    # amplitude of rows [r0,r1) and lines [c0,c1), block by block
+    step = max(1,EXPORTBLOCK//max(1,c1-c0))
+    if loi is not None: loi[0] = (r1-r0+step-1)//step
+    for i in range(r0,r1,step):
+        j = min(r1,i+step)
+        yield (i, np.abs(z[i:j,c0:c1]))
+        if loi is not None:
+            loi[1] += 1
+            if len(loi)>3 and loi[3]: return
+
+def exportCsv(filename, z, x, y, bounds, loi=None):
+    '''
+    One row per frame: time, then the amplitude of every line,
+    the header holds the frequencies. x and y are the time and
+    frequency axes of z, bounds (r0, r1, c0, c1) the part written
+    '''
+    (r0, r1, c0, c1) = bounds
+    with open(filename,'w',newline='') as fp:
+        writer = csv.writer(fp)
+        writer.writerow(['Time (s)']+['%g' % f for f in y[c0:c1]])
+        for (i, amp) in getBlocks(z, r0, r1, c0, c1, loi):
+            rows = np.column_stack((x[i:i+amp.shape[0]], amp))
+            np.savetxt(fp, rows, fmt='%.6g', delimiter=',')
+
+def exportXlsx(filename, z, x, y, bounds, loi=None):
+    # same layout as csv, constant_memory flushes every finished row
+    import xlsxwriter
+    (r0, r1, c0, c1) = bounds
+    if r1-r0+1>XLSXMAXROWS or c1-c0+1>XLSXMAXCOLS:
+        raise ValueError('%d x %d does not fit in a worksheet' % (r1-r0, c1-c0))
+    wb = xlsxwriter.Workbook(filename, {'constant_memory':True})
+    try:
+        ws = wb.add_worksheet('STFT')
+        num_format = wb.add_format({'num_format':'0.000'})
+        ws.write_string(0,0,'Time (s)')
+        ws.write_row(0,1,y[c0:c1].tolist(),num_format)
+        row = 1
+        for (i, amp) in getBlocks(z, r0, r1, c0, c1, loi):
+            for (t, d) in zip(x[i:i+amp.shape[0]].tolist(), amp.tolist()):
+                ws.write_number(row,0,t)
+                ws.write_row(row,1,d,num_format)
+                row += 1
+    finally:
+        wb.close()
+
+def exportHdf5(filename, z, x, y, bounds, loi=None):
+    # datasets 'amplitude' (frames, lines), 'time' and 'freq'
+    import h5py
+    (r0, r1, c0, c1) = bounds
+    with h5py.File(filename,'w') as f:
+        f.create_dataset('time', data=x[r0:r1])
+        f.create_dataset('freq', data=y[c0:c1])
+        amp = f.create_dataset('amplitude', shape=(r1-r0,c1-c0),
+            dtype=np.float32, chunks=True, compression='gzip')
+        for (i, block) in getBlocks(z, r0, r1, c0, c1, loi):
+            amp[i-r0:i-r0+block.shape[0]] = block
+
+EXPORTERS = {
+    '.csv':exportCsv,
+    '.xlsx':exportXlsx,
+    '.h5':exportHdf5
+}
@@ -4,12 +4,35 @@ from guiqwt.plot import ImageWidget
 from guiqwt.builder import make
 from rdsp.widgets import DisplayRangePicker
 from rdsp.module import ModuleType, ModuleBase
+from rdsp.modules.FFT.engine import (STFTEngine, ZoomEngine, Averager, checkBand,
+    WINDOWS, PRECISIONS, AVERAGES, TASKBLOCKS, ROWBLOCK, runTask, processFrames, processZoom,
+    extractPeaks, getOrderTrack, getRunningSpeed, PEAKDTYPE)
+from rdsp.modules.FFT.export import EXPORTERS
+from rdsp.modules.FFT.tiles import TileSource
+from rdsp.parallel import runTasks
+from os import path
 import numpy as np
 
+AVGSUFFIX = '-avg' # result key of the averaged spectrum
+BASEBANDSUFFIX = '-baseband' # temporary result of zoom
+PEAKSUFFIX = '-peaks' # result key of the peak table
+
+def getGrid(result, w):
+    # (t0, dt, f0, df), time of frame centres and frequency of lines
+    if 't0' in result:
+        return (result['t0'], result['dt'], result['f0'], result['df'])
+    # results before the axes were stored
+    sr = result['bandwidth']*2.56
+    ols = int(2*w*(1-result['overlap']/100))
+    return (w/sr, ols/sr, 0.0, sr/w/2)
+
 class FFTModule(ModuleBase):
     ModuleName = 'FFT'
+    ModuleVersion = 2
     ContextMenu = [
         {'title':'Process', 'action':'processNow'},
+        {'title':'Force Process', 'action':'processForce'},
+        {'title':'Extract Peaks', 'action':'processPeaks'},
         {'title':'Config', 'action':'setConfig'},
         {'title':'Delete', 'action':'delete'}
     ]
@@ -19,30 +42,81 @@ class FFTModule(ModuleBase):
         self.freqs = []
         self.config = {
             'lines':1000,
-            'overlap':70
+            'overlap':70,
+            'window':'hanning',
+            'precision':'double',
+            'average':'none',
+            'keepStft':True,
+            'zoom':None
         }
-        self.result = None
-        self.resultLoaded = False
         self.processed = processed
 
     def getResult(self):
-        if not self.resultLoaded:
-            self.result = gl.projectManager.loadResult(self.guid)[0]
-            self.resultLoaded = True
-        return self.result
+        # {track guid: info}, the matrices are opened by getFreqData
+        return gl.dataCache.get(('result',self.guid), self.loadResult)
+
+    def loadResult(self):
+        meta = gl.projectManager.loadResultMeta(self.guid)
+        if meta is None:
+            # old projects, all tracks pickled in one file
+            return gl.projectManager.loadResult(self.guid)[0]
+        return meta
+
+    def migrateResult(self):
+        '''
+        Old projects pickled every track in one file, move its matrices
+        to result/<guid>/ so arrays like the peak tables can be added
+        '''
+        meta = {}
+        for (guid, r) in self.loadResult().items():
+            r = dict(r)
+            data = r.pop('data', None)
+            if data is not None:
+                gl.projectManager.saveResultArray(self.guid, guid, data)
+            # numpy scalars are not json
+            r = {k:(v.item() if isinstance(v, np.generic) else v) for (k, v) in r.items()}
+            r['stft'] = data is not None
+            r.setdefault('average','none')
+            meta[guid] = r
+        gl.projectManager.saveResultMeta(self.guid, meta)
+        gl.projectManager.removeLegacyResult(self.guid)
+        gl.dataCache.removePrefix(('result',self.guid))
+        return meta
 
     def getFreqData(self, guid):
+        # {'bandwidth','overlap',('data'),('avg')}
         if self.processed:
-            result = self.getResult()
-            return result[guid]
+            result = dict(self.getResult()[guid])
+            if 'data' not in result and result.get('stft',True):
+                # memory-mapped, only this track's file is touched
+                result['data'] = gl.dataCache.get(('result',self.guid,guid),
+                    lambda: gl.projectManager.loadResultArray(self.guid, guid))
+            if result.get('average','none')!='none':
+                key = guid+AVGSUFFIX
+                result['avg'] = gl.dataCache.get(('result',self.guid,key),
+                    lambda: gl.projectManager.loadResultArray(self.guid, key, False))
+            return result
         return {}
 
+    def getPeakTable(self, guid):
+        # PEAKDTYPE records of every frame, None if not extracted
+        if not self.processed or 'peaks' not in self.getResult()[guid]:
+            return None
+        key = guid+PEAKSUFFIX
+        return gl.dataCache.get(('result',self.guid,key),
+            lambda: gl.projectManager.loadResultArray(self.guid, key, False))
+
     def configWindow(self, config=None):
         if not config:
             config = {
                 'name': self.name,
                 'lines':1000,
                 'overlap':70,
+                'window':'hanning',
+                'precision':'double',
+                'average':'rms',
+                'keepStft':False,
+                'zoom':None,
                 'trackSrc':self.parent.getTracksList(),
                 'tracks':[]
             }
@@ -57,7 +131,12 @@ class FFTModule(ModuleBase):
     def getProperty(self):
         return {
             'Lines':self.config['lines'],
-            'Overlap':self.config['overlap']
+            'Overlap':self.config['overlap'],
+            'Window':self.config['window'],
+            'Precision':self.config['precision'],
+            'Average':self.config['average'],
+            'Keep STFT':self.config['keepStft'],
+            'Zoom':self.config['zoom'] or 'None'
         }
 
     def parseConfig(self, config):
@@ -65,7 +144,15 @@ class FFTModule(ModuleBase):
             self.name = config['name']
         self.config = {
             'lines':config['lines'],
-            'overlap':config['overlap']
+            'overlap':config['overlap'],
+            'window':config.get('window','hanning'),
+            'precision':config.get('precision','double'),
+            # projects before averaging kept the full STFT only
+            'average':config.get('average','none'),
+            # without an average the STFT is the only thing stored
+            'keepStft':config.get('keepStft',True) or config.get('average','none')=='none',
+            # [fLow, fHigh] or None for the full band
+            'zoom':config.get('zoom')
         }
         self.tracks = [
             self.parent.getTrack(guid) for guid in config['tracks']
@@ -91,10 +178,16 @@ class FFTModule(ModuleBase):
             'guid':self.guid,
             'name':self.name,
             'processed':self.processed,
+            'fingerprint':self.fingerprint,
             'config':{
                 'tracks':[track.guid for track in self.tracks],
                 'lines':self.config['lines'],
                 'overlap':self.config['overlap'],
+                'window':self.config['window'],
+                'precision':self.config['precision'],
+                'average':self.config['average'],
+                'keepStft':self.config['keepStft'],
+                'zoom':self.config['zoom'],
                 'freqs':[freq.guid for freq in self.freqs]
             }
         }
@@ -107,56 +200,170 @@ class FFTModule(ModuleBase):
         cfg['trackSrc'] = self.parent.getTracksList()
         if self.configWindow(cfg):
             # self.parent.refresh()
-            gl.projectManager.saveProject()
+            gl.projectManager.saveNode(self)
 
     def delete(self):
         self.parent.removeProcess(self)
         if self.processed:
             gl.projectManager.removeResult(self.guid)
             
-    def processNow(self):
-        cfg = self.config
+    def processForce(self):
+        self.processNow(True)
 
-        Nw = cfg['lines'] * 2.56
-        win = np.hanning(Nw)
-        ols = np.int(Nw*(1-cfg['overlap']/100)) # OverLapStep
+    def processNow(self, force=False):
+        cfg = self.config
+        fingerprint = self.getFingerprint(cfg, self.tracks)
+        if self.processed and not force and fingerprint==self.fingerprint:
+            gl.progressManager.showMessage('%s: result is up to date' % self.name)
+            return
+
+        params = (cfg['lines'], cfg['overlap'], cfg['window'], cfg['precision'])
+        if cfg['zoom']:
+            try:
+                for track in self.tracks:
+                    checkBand(cfg['zoom'], track.getSampleRate())
+            except ValueError as e:
+                QtGui.QMessageBox.warning(None,'Zoom','%s: %s' % (track.name,e))
+                return
+        # virtual inputs are evaluated under a progress bar, not by every task
+        if not gl.projectManager.evaluateTracks(self.tracks):
+            return
 
         result = {}
         self.freqs.clear()
+        if self.processed:
+            gl.projectManager.removeResult(self.guid)
+            self.processed = False
+
+        # full band: every track is split in frame ranges, the ranges go to
+        # a process pool and each writes its rows of the track's result file
+        # zoom: one task per track, filtering is sequential
+        tasks = []
+        taskTrack = []
         for track in self.tracks:
-            track_data = track.getData()[0]
+            sr = track.getSampleRate()
+            if cfg['zoom']:
+                engine = ZoomEngine(*(params+(cfg['zoom'], sr)))
+                N = engine.getBasebandSize(track.getSize())
+            else:
+                engine = STFTEngine(*params)
+                N = track.getSize()
+            (t0, dt, f0, df) = engine.getAxes(sr)
             r = {
                 'bandwidth':track.config['bandwidth'],
                 'overlap':cfg['overlap'],
-                'data':None
+                'window':cfg['window'],
+                'average':cfg['average'],
+                'stft':cfg['keepStft'],
+                'zoom':cfg['zoom'],
+                't0':t0, 'dt':dt, 'f0':f0, 'df':df
                 # 'Nw'
             }
-            N = track_data.size
-            olt = np.floor((N-Nw)/ols)+1 # OverLapTimes
-            stride = track_data.strides[0]
-            
-            mat = np.lib.stride_tricks.as_strided(track_data, shape=(olt,Nw), strides=(stride*ols,stride))
-            mat_mean = mat.mean(axis=1).reshape(olt,1)
-            mat_dcLess = mat - mat_mean
-            mat_dcLess *= win
-            
-            mat_result = np.fft.fft(mat_dcLess)
-            mat_result_half = mat_result[:,:Nw/2]
-
-            # mat_amp = 2*2*np.abs(mat_result_half)/Nw # restore from window and fft
-            # mat_agl = np.angle(mat_result_half, deg=True)
-            r['data'] = 2*mat_result_half/Nw*2 # since the complex contain amp/agl info
+            # since the complex contain amp/agl info
+            resultPath = None
+            if cfg['keepStft']:
+                out = gl.projectManager.createResultArray(self.guid, track.guid,
+                    (engine.getFrameCount(N),engine.width), engine.ctype)
+                del out
+                resultPath = gl.projectManager.getResultPath(self.guid, track.guid)
+            if cfg['zoom']:
+                workPath = gl.projectManager.getResultPath(self.guid, track.guid+BASEBANDSUFFIX)
+                tasks.append((processZoom, track.getSource(), resultPath, params,
+                    cfg['zoom'], sr, cfg['average'], workPath))
+                taskTrack.append(track)
+            else:
+                for (first, last) in engine.getTasks(N):
+                    tasks.append((processFrames, track.getSource(), resultPath, params,
+                        first, last, cfg['average']))
+                    taskTrack.append(track)
             result[track.guid] = r
-            
+
+        remaining = {track.guid:taskTrack.count(track) for track in self.tracks}
+        averagers = {}
+        def funcname(loi):
+            def onDone(i, r):
+                track = taskTrack[i]
+                remaining[track.guid] -= 1
+                if not remaining[track.guid]:
+                    loi[4] = '%s done' % track.name
+            results = runTasks(runTask, tasks, loi, onDone)
+            # partial averages of one track merged in frame order
+            for (track, averager) in zip(taskTrack, results):
+                if averager is None: continue
+                if track.guid in averagers:
+                    averagers[track.guid].merge(averager)
+                else:
+                    averagers[track.guid] = averager
+            loi[2] = 1
+
+        loi = [len(tasks),0,0,False,None]
+        gl.progressManager.startNewProgress('FFT %s' % self.name,funcname,loi)
+        if loi[3]:
+            # cancelled, the partial result is dropped
+            gl.projectManager.removeResult(self.guid)
+            self.parent.refresh(self)
+            return
+
+        for track in self.tracks:
+            if track.guid in averagers:
+                # kilobytes, read at once by showResult
+                gl.projectManager.saveResultArray(self.guid, track.guid+AVGSUFFIX,
+                    averagers[track.guid].getResult())
             f = FFTFreqModule(track.guid, track.name, self)
             self.freqs.append(f)
 
-        gl.projectManager.saveResult(self.guid, [result])
-        self.result = result
+        gl.projectManager.saveResultMeta(self.guid, result)
+        gl.dataCache.put(('result',self.guid), result)
 
         self.processed = True
-        self.resultLoaded = True
-        self.parent.refresh()
+        self.fingerprint = fingerprint
+        self.parent.refresh(self)
+
+    def processPeaks(self):
+        # what was stored decides, not the config edited since
+        result = self.getResult() if self.processed else {}
+        if not result or not all(result[track.guid].get('stft',True) for track in self.tracks):
+            QtGui.QMessageBox.warning(None,'Peaks','Peaks are found in the STFT, check "Keep STFT" and process first.')
+            return
+        (count, ok) = QtGui.QInputDialog.getInt(None,'Peaks','Peaks per frame',10,1,1000)
+        if not ok: return
+        if gl.projectManager.loadResultMeta(self.guid) is None:
+            result = self.migrateResult()
+
+        # row ranges of the stored STFTs, in the pool as the FFT itself
+        tasks = []
+        taskTrack = []
+        for track in self.tracks:
+            r = result[track.guid]
+            data = gl.projectManager.loadResultArray(self.guid, track.guid)
+            (l, w) = data.shape
+            del data
+            grid = getGrid(r, w)[2:]
+            step = TASKBLOCKS*max(1,ROWBLOCK//w)
+            for first in range(0,l,step):
+                tasks.append((gl.projectManager.getResultPath(self.guid, track.guid),
+                    first, min(l,first+step), count, grid))
+                taskTrack.append(track)
+
+        tables = []
+        def funcname(loi):
+            tables.extend(runTasks(extractPeaks, tasks, loi))
+            loi[2] = 1
+
+        loi = [len(tasks),0,0,False,None]
+        gl.progressManager.startNewProgress('Peaks %s' % self.name,funcname,loi)
+        if loi[3]: return
+
+        for track in self.tracks:
+            # tasks of a track are in frame order, so is the joined table
+            table = np.concatenate([t for (t, tt) in zip(tables, taskTrack) if tt is track]
+                or [np.zeros(0, dtype=PEAKDTYPE)])
+            key = track.guid+PEAKSUFFIX
+            gl.projectManager.saveResultArray(self.guid, key, table)
+            gl.dataCache.remove(('result',self.guid,key))
+            result[track.guid]['peaks'] = count
+        gl.projectManager.saveResultMeta(self.guid, result)
+        gl.progressManager.showMessage('%s: peaks extracted' % self.name)
 
 class FFTConfig(QtGui.QDialog):
     def __init__(self, config):
@@ -181,7 +388,40 @@ class FFTConfig(QtGui.QDialog):
         txtLines.setValue(config['lines'])
 
         lblWindow = QtGui.QLabel('Window')
-        # cmbWindow = QtGui.QComboBox()
+        cmbWindow = QtGui.QComboBox()
+        cmbWindow.addItems(WINDOWS)
+        cmbWindow.setCurrentIndex(WINDOWS.index(config['window']))
+
+        lblPrecision = QtGui.QLabel('Precision')
+        cmbPrecision = QtGui.QComboBox()
+        precisions = sorted(PRECISIONS)
+        cmbPrecision.addItems(precisions)
+        cmbPrecision.setCurrentIndex(precisions.index(config['precision']))
+
+        lblAverage = QtGui.QLabel('Average')
+        cmbAverage = QtGui.QComboBox()
+        cmbAverage.addItems(AVERAGES)
+        cmbAverage.setCurrentIndex(AVERAGES.index(config['average']))
+
+        chkKeepStft = QtGui.QCheckBox('Keep STFT')
+        chkKeepStft.setChecked(config['keepStft'])
+        cmbAverage.currentIndexChanged.connect(self.updateKeepStft)
+
+        chkZoom = QtGui.QCheckBox('Zoom (Hz)')
+        zoom = config.get('zoom')
+        chkZoom.setChecked(bool(zoom))
+        txtZoomLow = QtGui.QDoubleSpinBox()
+        txtZoomHigh = QtGui.QDoubleSpinBox()
+        for txt in (txtZoomLow, txtZoomHigh):
+            txt.setRange(0,100000)
+            txt.setDecimals(1)
+        if zoom:
+            txtZoomLow.setValue(zoom[0])
+            txtZoomHigh.setValue(zoom[1])
+        layoutZoom = QtGui.QHBoxLayout()
+        layoutZoom.addWidget(chkZoom)
+        layoutZoom.addWidget(txtZoomLow)
+        layoutZoom.addWidget(txtZoomHigh)
 
         lblOverlap = QtGui.QLabel('Overlap (%)')
         txtOverlap = QtGui.QSpinBox()
@@ -203,8 +443,16 @@ class FFTConfig(QtGui.QDialog):
         layoutMain.addWidget(txtName)
         layoutMain.addWidget(lblLines)
         layoutMain.addWidget(txtLines)
+        layoutMain.addWidget(lblWindow)
+        layoutMain.addWidget(cmbWindow)
+        layoutMain.addWidget(lblPrecision)
+        layoutMain.addWidget(cmbPrecision)
         layoutMain.addWidget(lblOverlap)
         layoutMain.addWidget(txtOverlap)
+        layoutMain.addWidget(lblAverage)
+        layoutMain.addWidget(cmbAverage)
+        layoutMain.addWidget(chkKeepStft)
+        layoutMain.addLayout(layoutZoom)
         layoutMain.addWidget(btnTrack)
         layoutMain.addWidget(tblTrack)
         layoutMain.addWidget(buttonBox)
@@ -213,6 +461,20 @@ class FFTConfig(QtGui.QDialog):
         self.name_txt = txtName
         self.lines_txt = txtLines
         self.overlap_txt = txtOverlap
+        self.window_cmb = cmbWindow
+        self.precision_cmb = cmbPrecision
+        self.average_cmb = cmbAverage
+        self.keepStft_chk = chkKeepStft
+        self.zoom_chk = chkZoom
+        self.zoomLow_txt = txtZoomLow
+        self.zoomHigh_txt = txtZoomHigh
+        self.updateKeepStft()
+
+    def updateKeepStft(self):
+        # without an average the STFT has to be kept
+        none = self.average_cmb.currentText()=='none'
+        if none: self.keepStft_chk.setChecked(True)
+        self.keepStft_chk.setEnabled(not none)
 
     def addTrack(self, guid=None):
         tt = self.track_table
@@ -235,6 +497,20 @@ class FFTConfig(QtGui.QDialog):
     def removeTrack(self, index):
         self.track_table.removeRow(index)
 
+    def accept(self):
+        # the zoom band has to fit every track
+        if self.zoom_chk.isChecked():
+            band = (self.zoomLow_txt.value(), self.zoomHigh_txt.value())
+            trackSrc = self.config['trackSrc']
+            tt = self.track_table
+            try:
+                checkBand(band, min([trackSrc[tt.cellWidget(i,0).currentIndex()]['sr']
+                    for i in range(tt.rowCount())] or [float('inf')]))
+            except ValueError as e:
+                QtGui.QMessageBox.warning(self,'Zoom',str(e))
+                return
+        super().accept()
+
     def getResult(self):
         tt = self.track_table
         trackSrc = self.config['trackSrc']
@@ -242,10 +518,20 @@ class FFTConfig(QtGui.QDialog):
         for i in range(tt.rowCount()):
             tracks.append(trackSrc[tt.cellWidget(i,0).currentIndex()]['guid'])
 
+        zoom = None
+        (fLow, fHigh) = (self.zoomLow_txt.value(), self.zoomHigh_txt.value())
+        if self.zoom_chk.isChecked():
+            zoom = [fLow, fHigh]
+
         return {
             'name':self.name_txt.text(),
             'lines':self.lines_txt.value(),
             'overlap':self.overlap_txt.value(),
+            'window':self.window_cmb.currentText(),
+            'precision':self.precision_cmb.currentText(),
+            'average':self.average_cmb.currentText(),
+            'keepStft':self.keepStft_chk.isChecked() or self.average_cmb.currentText()=='none',
+            'zoom':zoom,
             'tracks':tracks
         }
 
@@ -255,20 +541,17 @@ class FFTFreqModule(ModuleBase):
     ContextMenu = [
         {'title':'Show Result', 'action':'showResult'}, #FirstPhase,Average
         {'title':'Export', 'action':'export2xlsx'}, #TBDetermined
-        {'title':'Show STFT', 'action':'showStft'}
+        {'title':'Show STFT', 'action':'showStft'},
+        {'title':'Show Orders', 'action':'showOrders'}
     ]
     def __init__(self, guid, name, parent):
         super().__init__(guid,name,parent)
-        self.data = None
         self.config = {}
-        self.dataLoaded = False
         self.track = self.parent.parent.getTrack(self.guid)
 
     def getData(self):
-        if not self.dataLoaded:
-            self.data = self.parent.getFreqData(self.guid)
-            self.dataLoaded = True
-        return self.data
+        # not kept here, the result cache of parent decides
+        return self.parent.getFreqData(self.guid)
 
     def getListConfig(self):
         cfg = {
@@ -291,59 +574,196 @@ class FFTFreqModule(ModuleBase):
         return {}
 
     def export2xlsx(self):
-        pass
+        # the STFT if kept, otherwise the averaged spectrum as one row
+        result = self.getData()
+        if 'data' in result:
+            z = result['data']
+        elif 'avg' in result:
+            z = result['avg'].reshape(1,-1)
+        else:
+            return
+
+        duration = self.track.getSize()/self.track.getSampleRate()
+        rp = DisplayRangePicker(maxFreq=self.track.config['bandwidth'],
+            maxTime=int(np.ceil(duration)) if 'data' in result else None)
+        rp.exec()
+        if not rp.result(): return
+        filename = QtGui.QFileDialog.getSaveFileName(caption='Export Spectrum',
+            filter='Excel File (*.xlsx);;CSV File (*.csv);;HDF5 File (*.h5)')
+        if not filename: return
+        exporter = EXPORTERS.get(path.splitext(filename)[1].lower())
+        if exporter is None:
+            QtGui.QMessageBox.warning(None,'Export','Unknown file type, use .xlsx, .csv or .h5.')
+            return
+
+        (l,w) = z.shape
+        (x, y) = self.getAxes(result, l, w)
+        bounds = getRange(result, z.shape, rp.getResult())
+        errors = []
+        def funcname(loi):
+            try:
+                exporter(filename, z, x, y, bounds, loi)
+            except Exception as e:
+                errors.append(str(e))
+            loi[2] = 1
+        loi = [1,0,0,False,None]
+        gl.progressManager.startNewProgress('Export %s' % self.name,funcname,loi)
+        if errors:
+            QtGui.QMessageBox.warning(None,'Export',errors[0])
+
+    def getAxes(self, result, l, w):
+        (t0, dt, f0, df) = getGrid(result, w)
+        return (t0+np.arange(l)*dt, f0+np.arange(w)*df)
 
     def showResult(self):
         result = self.getData()
         # result {'data','bandwidth','overlap'}
         # widget = FFTFreqWidget(data)
         # gl.plotManager.addWidget(self.name,widget)
-        d = result['data']
-        (l,w) = d.shape
-        sr = result['bandwidth']*2.56
-        x = np.fft.fftfreq(2*w,1/sr)[:w]
-        y = d.mean(0)
+        if 'avg' in result:
+            y = result['avg']
+        elif 'data' not in result:
+            QtGui.QMessageBox.warning(None,'Result','Neither the STFT nor an average is stored, process again.')
+            return
+        else:
+            # only the STFT stored, average it row block by row block
+            d = result['data']
+            averager = Averager('linear', d.shape[1])
+            step = max(1,ROWBLOCK//d.shape[1])
+            for i in range(0,d.shape[0],step):
+                averager.add(d[i:i+step])
+            y = averager.getResult()
+        (t, x) = self.getAxes(result, 0, y.size)
         gl.plotManager.plotNew((self.name,x,y))
 
-    def showStft(self):
+    def showOrders(self):
+        '''
+        1x/2x amplitude over time from the peak table,
+        1x is the highest peak of each frame in the picked band
+        '''
+        peaks = self.parent.getPeakTable(self.guid)
+        if peaks is None:
+            QtGui.QMessageBox.warning(None,'Orders','No peak table, run "Extract Peaks" first.')
+            return
         rp = DisplayRangePicker(maxFreq=self.track.config['bandwidth'])
         rp.exec()
+        if not rp.result() or not rp.getResult()['freq']: return
+
+        result = self.getData()
+        (l,w) = result['data'].shape
+        (t0, dt, f0, df) = getGrid(result, w)
+        x = t0+np.arange(l)*dt
+        speed = getRunningSpeed(peaks, l, rp.getResult()['freq'])
+        valid = ~np.isnan(speed)
+        gl.plotManager.plotNew((self.name+' 1x',x[valid],
+            getOrderTrack(peaks, l, speed, 1, df)[valid]))
+        gl.plotManager.plotOver((self.name+' 2x',x[valid],
+            getOrderTrack(peaks, l, speed, 2, 2*df)[valid]))
+
+    def showStft(self):
+        result = self.getData()
+        if 'data' not in result:
+            QtGui.QMessageBox.warning(None,'STFT','STFT was not kept, check "Keep STFT" and process again.')
+            return
+
+        duration = self.track.getSize()/self.track.getSampleRate()
+        rp = DisplayRangePicker(maxFreq=self.track.config['bandwidth'],
+            maxTime=int(np.ceil(duration)))
+        rp.exec()
         if rp.result():
-            result = self.getData()
             config = rp.getResult()
 
-            (l,w) = result['data'].shape
-            sr = result['bandwidth']*2.56
-            ols = np.int(2*w*(1-result['overlap']/100))
-            x = (np.arange(l)*ols+w)/sr
-            # intercept x if time was provided
-            y = np.fft.fftfreq(2*w,1/sr)[:w]
             z = result['data']
-            if config['freq']:
-                (lower,upper) = config['freq']
-                bLow = y>=(lower-0.5)
-                bUp = y<=(upper+0.5)
-                bAll = np.all([bLow,bUp],axis=0)
-                y = y[bAll]
-                z = z[:,bAll]
-            (Y,X) = np.meshgrid(y,x)
-            Z = np.abs(z)
-            
-            widget = FFTStftWidget((X,Y,Z))
+            (t0, dt, f0, df) = getGrid(result, z.shape[1])
+            (r0, r1, c0, c1) = getRange(result, z.shape, config)
+            if r1<=r0 or c1<=c0:
+                gl.progressManager.showMessage('%s: no frame in the range' % self.name)
+                return
+            bounds = (t0+(r0-0.5)*dt, t0+(r1-0.5)*dt, f0+(c0-0.5)*df, f0+(c1-0.5)*df)
+
+            widget = FFTStftWidget(TileSource(z, (r0, r1, c0, c1)), bounds)
             gl.plotManager.addWidget(self.name,widget)
 
+def getRange(result, shape, config):
+    '''
+    (r0, r1, c0, c1) of the frames and lines in the time and freq range
+    of a DisplayRangePicker result. Frames and lines are a regular grid,
+    so the range is sliced by index and only its rows are read.
+    '''
+    (l,w) = shape
+    (t0, dt, f0, df) = getGrid(result, w)
+    (r0, r1) = (0, l)
+    if config.get('time'):
+        (lower,upper) = config['time']
+        r0 = min(l,max(0,int(np.ceil((lower-t0)/dt))))
+        r1 = min(l,max(r0,int(np.floor((upper-t0)/dt))+1))
+    (c0, c1) = (0, w)
+    if config.get('freq'):
+        (lower,upper) = config['freq']
+        c0 = min(w,max(0,int(np.ceil((lower-0.5-f0)/df))))
+        c1 = min(w,max(c0,int(np.floor((upper+0.5-f0)/df))+1))
+    return (r0, r1, c0, c1)
+
 class FFTFreqWidget(QtGui.QWidget):
     def __init__(self, result):
         super().__init__()
 
 class FFTStftWidget(ImageWidget):
-    def __init__(self, xyz):
+    '''
+    Spectrogram on a regular grid, placed by its bounds (xmin, xmax, ymin, ymax).
+    tiles is a TileSource, on zoom only the visible part of the level
+    closest to screen resolution is computed and given to the image item.
+    '''
+    def __init__(self, tiles, bounds):
         super().__init__(xlabel='Time', ylabel='Frequency',
             xunit='s', yunit='Hz', yreverse=False, lock_aspect_ratio=False)
-        (x,y,z) = xyz
-        itm = make.pcolor(x,y,z)
+        self.tiles = tiles
+        self.bounds = bounds
+        self.tile = None
+        (xmin, xmax, ymin, ymax) = bounds
+        k = tiles.levels-1
+        (h, w) = tiles.getShape(k)
+        image = tiles.getImage(k, 0, h, 0, w)
+        itm = make.image(image, xdata=[xmin,xmax], ydata=[ymin,ymax],
+            colormap='jet', interpolation='nearest')
+        self.lutRange = tiles.getLutRange()
+        itm.set_lut_range(self.lutRange)
         self.plot.add_item(itm)
+        self.item = itm
         self.register_all_image_tools()
+        self.plot.SIG_PLOT_AXIS_CHANGED.connect(self.updateTile)
+
+    def updateTile(self, plot=None):
+        plot = self.plot
+        (xmin, xmax, ymin, ymax) = self.bounds
+        (xa, xb) = sorted(plot.get_axis_limits(plot.xBottom))
+        (ya, yb) = sorted(plot.get_axis_limits(plot.yLeft))
+        canvas = plot.canvas()
+        tiles = self.tiles
+        (h0, w0) = tiles.shape
+        dx = (xmax-xmin)/w0
+        dy = (ymax-ymin)/h0
+
+        # visible pixels of the full image per screen pixel
+        ratio = min((xb-xa)/dx/max(1,canvas.width()), (yb-ya)/dy/max(1,canvas.height()))
+        k = int(np.clip(np.floor(np.log2(max(ratio,1))),0,tiles.levels-1))
+        (h, w) = tiles.getShape(k)
+        (dx, dy) = (dx*2**k, dy*2**k)
+        # one tile pixel of margin, so panning a little shows no edge
+        i0 = int(np.clip(np.floor((xa-xmin)/dx)-1,0,w))
+        i1 = int(np.clip(np.ceil((xb-xmin)/dx)+1,i0,w))
+        j0 = int(np.clip(np.floor((ya-ymin)/dy)-1,0,h))
+        j1 = int(np.clip(np.ceil((yb-ymin)/dy)+1,j0,h))
+        if i1<=i0 or j1<=j0: return
+        tile = (k, i0, i1, j0, j1)
+        if tile==self.tile: return
+        self.tile = tile
+
+        itm = self.item
+        itm.set_data(tiles.getImage(k, j0, j1, i0, i1), lut_range=self.lutRange)
+        itm.set_xdata(xmin+i0*dx, min(xmax,xmin+i1*dx))
+        itm.set_ydata(ymin+j0*dy, min(ymax,ymin+j1*dy))
+        plot.replot()
 
 from matplotlib.backends.backend_qt4agg import FigureCanvasQTAgg as FigureCanvas, NavigationToolbar2QT as NavigationToolbar
 import matplotlib.pyplot as plt
@@ -0,0 +1,83 @@
+from collections import OrderedDict
+import numpy as np
+from rdsp.modules.FFT.engine import ROWBLOCK
+
+# the spectrogram image is never built whole, the widget asks for the
+# tiles it shows and only those are read from the memory-mapped STFT
+TILESIZE = 256 # pixels a side of a tile
+TILECACHE = 64 # tiles kept, least recently shown dropped first
+
+def poolMax(a, f):
+    # maximum of f x f pixels, a partial block at the end repeats its edge
+    if f==1: return a
+    (h, w) = a.shape
+    a = np.pad(a, ((0,-h%f),(0,-w%f)), mode='edge')
+    return a.reshape(a.shape[0]//f,f,a.shape[1]//f,f).max(axis=(1,3))
+
+class TileSource(object):
+    '''
+    dB image (line, frame) of rows [r0,r1) and lines [c0,c1) of a stored STFT.
+    Level k keeps the maximum of 2^k x 2^k pixels so narrow peaks stay
+    visible, the coarsest level fits in one tile. Tiles are computed
+    on request, row block by row block, and the recent ones cached.
+    '''
+    def __init__(self, z, bounds, tileSize=TILESIZE, cacheSize=TILECACHE, floor=1e-12):
+        self.z = z
+        (self.r0, self.r1, self.c0, self.c1) = bounds
+        self.shape = (self.c1-self.c0, self.r1-self.r0)
+        self.tileSize = tileSize
+        self.cacheSize = cacheSize
+        self.floor = floor
+        self.cache = OrderedDict()
+        self.levels = 1
+        while max(self.getShape(self.levels-1))>tileSize:
+            self.levels += 1
+
+    def getShape(self, k):
+        f = 2**k
+        return tuple((n+f-1)//f for n in self.shape)
+
+    def computeTile(self, k, tj, ti):
+        f = 2**k
+        T = self.tileSize*f # level 0 pixels a side of the tile
+        (h, w) = self.shape
+        (a0, a1) = (tj*T, min(h,(tj+1)*T))
+        (b0, b1) = (ti*T, min(w,(ti+1)*T))
+        # frames read at once, a multiple of f so blocks pool on their own
+        step = max(f, ROWBLOCK//max(1,a1-a0)//f*f)
+        parts = []
+        for i in range(b0,b1,step):
+            j = min(b1,i+step)
+            amp = np.abs(self.z[self.r0+i:self.r0+j,self.c0+a0:self.c0+a1])
+            parts.append(poolMax(amp.T, f))
+        amp = np.hstack(parts)
+        np.maximum(amp, self.floor, out=amp)
+        return (20*np.log10(amp)).astype(np.float32)
+
+    def getTile(self, k, tj, ti):
+        key = (k, tj, ti)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+        else:
+            self.cache[key] = self.computeTile(k, tj, ti)
+            while len(self.cache)>self.cacheSize:
+                self.cache.popitem(last=False)
+        return self.cache[key]
+
+    def getImage(self, k, j0, j1, i0, i1):
+        # pixels [j0,j1) x [i0,i1) of level k, assembled from their tiles
+        T = self.tileSize
+        image = np.empty((j1-j0,i1-i0), dtype=np.float32)
+        for tj in range(j0//T,(j1-1)//T+1):
+            for ti in range(i0//T,(i1-1)//T+1):
+                tile = self.getTile(k, tj, ti)
+                (a0, a1) = (max(j0,tj*T), min(j1,(tj+1)*T))
+                (b0, b1) = (max(i0,ti*T), min(i1,(ti+1)*T))
+                image[a0-j0:a1-j0,b0-i0:b1-i0] = tile[a0-tj*T:a1-tj*T,b0-ti*T:b1-ti*T]
+        return image
+
+    def getLutRange(self):
+        # from the coarsest level, the one tile shown first
+        (h, w) = self.getShape(self.levels-1)
+        image = self.getImage(self.levels-1, 0, h, 0, w)
+        return (float(image.min()), float(image.max()))
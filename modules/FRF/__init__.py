@@ -0,0 +1,3 @@
+from rdsp.modules.FRF.main import FRFModule as RDSP_Module, FRFFreqModule
+RDSP_Modules = [FRFFreqModule]
+ISREADY = True
\ No newline at end of file
@@ -0,0 +1,53 @@
+import numpy as np
+from rdsp import storage
+from rdsp.modules.FFT.engine import STFTEngine, BLOCKSIZE
+
+class CrossSpectra(object):
+    '''
+    Auto- and cross-spectra of a reference and N responses summed frame by frame,
+    the spectra of all tracks come in one (N+1, frames, lines) array
+    '''
+    def __init__(self, count, lines):
+        self.frames = 0
+        self.gxx = np.zeros(lines)
+        self.gyy = np.zeros((count,lines))
+        self.gxy = np.zeros((count,lines), dtype=np.complex128)
+
+    def add(self, spectra):
+        x = spectra[0]
+        y = spectra[1:]
+        self.gxx += (x.real**2+x.imag**2).sum(axis=0)
+        self.gyy += (y.real**2+y.imag**2).sum(axis=1)
+        self.gxy += np.einsum('fl,nfl->nl', x.conj(), y)
+        self.frames += x.shape[0]
+
+    def merge(self, other):
+        self.gxx += other.gxx
+        self.gyy += other.gyy
+        self.gxy += other.gxy
+        self.frames += other.frames
+
+    def getFRF(self):
+        # H1 estimator, (N, lines)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.gxx>0, self.gxy/self.gxx, 0)
+
+    def getCoherence(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            coh = np.abs(self.gxy)**2/(self.gxx*self.gyy)
+        return np.nan_to_num(coh)
+
+def processCross(sources, params, first, last):
+    '''
+    Worker task: frames [first, last) of the reference sources[0]
+    and the responses sources[1:], returns the CrossSpectra of the range
+    '''
+    engine = STFTEngine(*params)
+    tracks = [storage.openSource(source) for source in sources]
+    N = min(track.shape[-1] for track in tracks)
+    # the block holds every track, keep the memory of one FFT block
+    blockSize = max(engine.Nw, BLOCKSIZE//len(tracks))
+    read = lambda start, stop: np.vstack([track[0,start:stop] for track in tracks])
+    cross = CrossSpectra(len(tracks)-1, engine.width)
+    engine.process(read, N, None, blockSize, first, last, cross)
+    return cross
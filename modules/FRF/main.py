@@ -0,0 +1,383 @@
+from rdsp import gl
+from PyQt4 import QtGui
+from rdsp.module import ModuleType, ModuleBase
+from rdsp.modules.FFT.engine import STFTEngine, WINDOWS, PRECISIONS
+from rdsp.modules.FRF.engine import processCross
+from rdsp.parallel import runTasks
+import numpy as np
+
+FRFSUFFIX = '-frf' # result key of H1 of a response
+COHSUFFIX = '-coh' # result key of the coherence of a response
+
+class FRFModule(ModuleBase):
+    '''
+    FRF (H1) and coherence of response tracks against one reference,
+    all tracks are segmented and transformed together in one pass
+    '''
+    ModuleName = 'FRF'
+    ContextMenu = [
+        {'title':'Process', 'action':'processNow'},
+        {'title':'Force Process', 'action':'processForce'},
+        {'title':'Config', 'action':'setConfig'},
+        {'title':'Delete', 'action':'delete'}
+    ]
+    def __init__(self, guid, name, parent, processed=False):
+        super().__init__(guid,name,parent)
+        self.reference = None
+        self.tracks = []
+        self.freqs = []
+        self.config = {
+            'lines':1000,
+            'overlap':70,
+            'window':'hanning',
+            'precision':'double'
+        }
+        self.processed = processed
+
+    def getResult(self):
+        # {response guid: info}
+        return gl.dataCache.get(('result',self.guid),
+            lambda: gl.projectManager.loadResultMeta(self.guid))
+
+    def getFreqData(self, guid):
+        # {'reference','frames','f0','df','frf','coherence'}
+        if self.processed:
+            result = dict(self.getResult()[guid])
+            for (name, suffix) in (('frf',FRFSUFFIX), ('coherence',COHSUFFIX)):
+                key = guid+suffix
+                result[name] = gl.dataCache.get(('result',self.guid,key),
+                    lambda: gl.projectManager.loadResultArray(self.guid, key, False))
+            return result
+        return {}
+
+    def configWindow(self, config=None):
+        if not config:
+            config = {
+                'name': self.name,
+                'lines':1000,
+                'overlap':70,
+                'window':'hanning',
+                'precision':'double',
+                'trackSrc':self.parent.getTracksList(),
+                'reference':None,
+                'tracks':[]
+            }
+
+        cfgWin = FRFConfig(config)
+        cfgWin.exec_()
+        if cfgWin.result():
+            self.parseConfig(cfgWin.getResult())
+            return True
+        return False
+
+    def getProperty(self):
+        return {
+            'Reference':self.reference.name if self.reference else '',
+            'Lines':self.config['lines'],
+            'Overlap':self.config['overlap'],
+            'Window':self.config['window'],
+            'Precision':self.config['precision']
+        }
+
+    def parseConfig(self, config):
+        if 'name' in config:
+            self.name = config['name']
+        self.config = {
+            'lines':config['lines'],
+            'overlap':config['overlap'],
+            'window':config['window'],
+            'precision':config['precision']
+        }
+        self.reference = self.parent.getTrack(config['reference'])
+        self.tracks = [
+            self.parent.getTrack(guid) for guid in config['tracks']
+        ]
+        if 'freqs' in config:
+            self.freqs = [
+                FRFFreqModule(guid, self.parent.getTrack(guid).name, self) for guid in config['freqs']
+            ]
+
+    def getListConfig(self):
+        config = {
+            'type':self.ModuleName,
+            'name':self.name,
+            'object':self,
+            'sub':[freq.getListConfig() for freq in self.freqs]
+        }
+        return config
+
+    def getFileConfig(self):
+        config = {
+            'type':self.ModuleName,
+            'guid':self.guid,
+            'name':self.name,
+            'processed':self.processed,
+            'fingerprint':self.fingerprint,
+            'config':{
+                'reference':self.reference.guid,
+                'tracks':[track.guid for track in self.tracks],
+                'lines':self.config['lines'],
+                'overlap':self.config['overlap'],
+                'window':self.config['window'],
+                'precision':self.config['precision'],
+                'freqs':[freq.guid for freq in self.freqs]
+            }
+        }
+        return config
+
+    def setConfig(self):
+        cfg = self.getFileConfig()['config']
+        cfg['name'] = self.name
+        cfg['trackSrc'] = self.parent.getTracksList()
+        if self.configWindow(cfg):
+            gl.projectManager.saveNode(self)
+
+    def delete(self):
+        self.parent.removeProcess(self)
+        if self.processed:
+            gl.projectManager.removeResult(self.guid)
+
+    def processForce(self):
+        self.processNow(True)
+
+    def processNow(self, force=False):
+        cfg = self.config
+        tracks = [self.reference]+self.tracks
+        fingerprint = self.getFingerprint(cfg, tracks)
+        if self.processed and not force and fingerprint==self.fingerprint:
+            gl.progressManager.showMessage('%s: result is up to date' % self.name)
+            return
+
+        sr = self.reference.getSampleRate()
+        if any(track.getSampleRate()!=sr for track in self.tracks):
+            QtGui.QMessageBox.warning(None,'FRF','All tracks need the bandwidth of the reference.')
+            return
+        # virtual inputs are evaluated under a progress bar, not by every task
+        if not gl.projectManager.evaluateTracks(tracks):
+            return
+
+        self.freqs.clear()
+        if self.processed:
+            gl.projectManager.removeResult(self.guid)
+            self.processed = False
+
+        # frame ranges over all tracks at once, each task reads every track
+        params = (cfg['lines'], cfg['overlap'], cfg['window'], cfg['precision'])
+        engine = STFTEngine(*params)
+        N = min(track.getSize() for track in tracks)
+        sources = [track.getSource() for track in tracks]
+        tasks = [(sources, params, first, last) for (first, last) in engine.getTasks(N)]
+
+        cross = []
+        def funcname(loi):
+            results = runTasks(processCross, tasks, loi)
+            # partial sums, the order does not matter
+            for r in results:
+                if r is None: continue
+                if cross:
+                    cross[0].merge(r)
+                else:
+                    cross.append(r)
+            loi[2] = 1
+
+        loi = [len(tasks),0,0,False,None]
+        gl.progressManager.startNewProgress('FRF %s' % self.name,funcname,loi)
+        if loi[3] or not cross:
+            self.parent.refresh(self)
+            return
+
+        cross = cross[0]
+        frf = cross.getFRF()
+        coh = cross.getCoherence()
+        (t0, dt, f0, df) = engine.getAxes(sr)
+        result = {}
+        for (i, track) in enumerate(self.tracks):
+            result[track.guid] = {
+                'reference':self.reference.guid,
+                'frames':cross.frames,
+                'f0':f0, 'df':df
+            }
+            gl.projectManager.saveResultArray(self.guid, track.guid+FRFSUFFIX, frf[i])
+            gl.projectManager.saveResultArray(self.guid, track.guid+COHSUFFIX, coh[i])
+            self.freqs.append(FRFFreqModule(track.guid, track.name, self))
+
+        gl.projectManager.saveResultMeta(self.guid, result)
+        gl.dataCache.put(('result',self.guid), result)
+
+        self.processed = True
+        self.fingerprint = fingerprint
+        self.parent.refresh(self)
+
+class FRFConfig(QtGui.QDialog):
+    def __init__(self, config):
+        super().__init__()
+        self.config = config
+        self.setWindowTitle('FRF Configuration')
+        self.initUI()
+
+    def initUI(self):
+        config = self.config
+        trackSrc = config['trackSrc']
+        buttonBox = QtGui.QDialogButtonBox(QtGui.QDialogButtonBox.Ok | QtGui.QDialogButtonBox.Cancel)
+        buttonBox.accepted.connect(self.accept)
+        buttonBox.rejected.connect(self.reject)
+
+        lblName = QtGui.QLabel('Name')
+        txtName = QtGui.QLineEdit(config['name'])
+
+        lblReference = QtGui.QLabel('Reference')
+        cmbReference = QtGui.QComboBox()
+        cmbReference.addItems([track['name'] for track in trackSrc])
+        for i in range(len(trackSrc)):
+            if trackSrc[i]['guid']==config['reference']:
+                cmbReference.setCurrentIndex(i)
+                break
+
+        lblLines = QtGui.QLabel('Lines')
+        txtLines = QtGui.QSpinBox()
+        txtLines.setRange(100,50000)
+        txtLines.setSingleStep(100)
+        txtLines.setValue(config['lines'])
+
+        lblWindow = QtGui.QLabel('Window')
+        cmbWindow = QtGui.QComboBox()
+        cmbWindow.addItems(WINDOWS)
+        cmbWindow.setCurrentIndex(WINDOWS.index(config['window']))
+
+        lblPrecision = QtGui.QLabel('Precision')
+        cmbPrecision = QtGui.QComboBox()
+        precisions = sorted(PRECISIONS)
+        cmbPrecision.addItems(precisions)
+        cmbPrecision.setCurrentIndex(precisions.index(config['precision']))
+
+        lblOverlap = QtGui.QLabel('Overlap (%)')
+        txtOverlap = QtGui.QSpinBox()
+        txtOverlap.setRange(0,99)
+        txtOverlap.setSingleStep(1)
+        txtOverlap.setValue(config['overlap'])
+
+        btnTrack = QtGui.QCommandLinkButton('Add Response')
+        btnTrack.clicked.connect(self.addTrack)
+        tblTrack = QtGui.QTableWidget(0,1)
+        tblTrack.setHorizontalHeaderLabels(['Track Name'])
+        tblTrack.verticalHeader().sectionDoubleClicked.connect(self.removeTrack)
+        self.track_table = tblTrack
+        for track in config['tracks']:
+            self.addTrack(track)
+
+        layoutMain = QtGui.QVBoxLayout()
+        layoutMain.addWidget(lblName)
+        layoutMain.addWidget(txtName)
+        layoutMain.addWidget(lblReference)
+        layoutMain.addWidget(cmbReference)
+        layoutMain.addWidget(lblLines)
+        layoutMain.addWidget(txtLines)
+        layoutMain.addWidget(lblWindow)
+        layoutMain.addWidget(cmbWindow)
+        layoutMain.addWidget(lblPrecision)
+        layoutMain.addWidget(cmbPrecision)
+        layoutMain.addWidget(lblOverlap)
+        layoutMain.addWidget(txtOverlap)
+        layoutMain.addWidget(btnTrack)
+        layoutMain.addWidget(tblTrack)
+        layoutMain.addWidget(buttonBox)
+        self.setLayout(layoutMain)
+
+        self.name_txt = txtName
+        self.reference_cmb = cmbReference
+        self.lines_txt = txtLines
+        self.overlap_txt = txtOverlap
+        self.window_cmb = cmbWindow
+        self.precision_cmb = cmbPrecision
+
+    def addTrack(self, guid=None):
+        tt = self.track_table
+        n = tt.rowCount()
+        tt.setRowCount(n+1)
+        trackSrc = self.config['trackSrc']
+
+        cmbTracks = QtGui.QComboBox()
+        tracks = [track['name'] for track in trackSrc]
+        cmbTracks.addItems(tracks)
+
+        tt.setCellWidget(n,0,cmbTracks)
+
+        if guid:
+            for i in range(len(tracks)):
+                if guid==trackSrc[i]['guid']:
+                    cmbTracks.setCurrentIndex(i)
+                    break
+
+    def removeTrack(self, index):
+        self.track_table.removeRow(index)
+
+    def getResult(self):
+        tt = self.track_table
+        trackSrc = self.config['trackSrc']
+        tracks = []
+        for i in range(tt.rowCount()):
+            tracks.append(trackSrc[tt.cellWidget(i,0).currentIndex()]['guid'])
+
+        return {
+            'name':self.name_txt.text(),
+            'reference':trackSrc[self.reference_cmb.currentIndex()]['guid'],
+            'lines':self.lines_txt.value(),
+            'overlap':self.overlap_txt.value(),
+            'window':self.window_cmb.currentText(),
+            'precision':self.precision_cmb.currentText(),
+            'tracks':tracks
+        }
+
+class FRFFreqModule(ModuleBase):
+    ModuleName = 'FRFFreq'
+    ModuleType = ModuleType.config
+    ContextMenu = [
+        {'title':'Show FRF', 'action':'showFRF'},
+        {'title':'Show Phase', 'action':'showPhase'},
+        {'title':'Show Coherence', 'action':'showCoherence'}
+    ]
+    def __init__(self, guid, name, parent):
+        super().__init__(guid,name,parent)
+        self.config = {}
+        self.track = self.parent.parent.getTrack(self.guid)
+
+    def getData(self):
+        return self.parent.getFreqData(self.guid)
+
+    def getListConfig(self):
+        cfg = {
+            'type':self.ModuleName,
+            'name':self.name,
+            'object':self,
+            'sub':[
+                self.track.getListConfig()
+            ]
+        }
+        return cfg
+
+    def getFileConfig(self):
+        pass
+
+    def parseConfig(self, config):
+        pass
+
+    def getProperty(self):
+        return {}
+
+    def getFreqs(self, result, w):
+        return result['f0']+np.arange(w)*result['df']
+
+    def showFRF(self):
+        result = self.getData()
+        y = np.abs(result['frf'])
+        gl.plotManager.plotNew((self.name+' FRF',self.getFreqs(result,y.size),y))
+
+    def showPhase(self):
+        result = self.getData()
+        y = np.angle(result['frf'],deg=True)
+        gl.plotManager.plotNew((self.name+' Phase',self.getFreqs(result,y.size),y))
+
+    def showCoherence(self):
+        result = self.getData()
+        y = result['coherence']
+        gl.plotManager.plotNew((self.name+' Coherence',self.getFreqs(result,y.size),y))
@@ -0,0 +1,126 @@
+import os
+from functools import lru_cache
+import numpy as np
+from scipy import signal
+from rdsp import storage
+
+BLOCKSIZE = 1<<20 # samples filtered at once
+WORKSUFFIX = '-forward' # intermediate of the forward pass, next to the track
+
+@lru_cache(maxsize=64)
+def getDesign(order, type, Wn):
+    return signal.butter(order, Wn, type, output='sos')
+
+def design(order, type, Wn):
+    '''
+    Second-order sections, (b, a) loses precision at high orders.
+    Memoized, Wn is the band normalized to Nyquist as a float or tuple,
+    tracks of the same bandwidth share one design. Each caller gets
+    its own copy, scipy's filters want a writable array.
+    '''
+    return getDesign(order, type, Wn).copy()
+
+class SOSFilter(object):
+    '''
+    Zero-phase filtering of a long track block by block,
+    same result as signal.sosfiltfilt with its default odd padding.
+    The forward pass goes to a work array on disk, the backward pass
+    reads it from the end, the filter state is carried between blocks.
+    '''
+    def __init__(self, sos, blockSize=BLOCKSIZE):
+        self.sos = sos
+        self.blockSize = blockSize
+        self.zi = signal.sosfilt_zi(sos)
+        ntaps = 2*len(sos)+1
+        ntaps -= min((sos[:,2]==0).sum(), (sos[:,5]==0).sum())
+        self.padlen = 3*ntaps
+
+    def getPadding(self, N):
+        return min(self.padlen, N-1)
+
+    def getWorkSize(self, N):
+        return N+2*self.getPadding(N)
+
+    def segments(self, read, N):
+        # the track with odd extensions at both ends, block by block
+        p = self.getPadding(N)
+        x0 = read(0,p+1)
+        x1 = read(N-p-1,N)
+        yield 2*x0[0]-x0[p:0:-1]
+        for s0 in range(0,N,self.blockSize):
+            yield read(s0,min(N,s0+self.blockSize))
+        yield 2*x1[-1]-x1[-2::-1]
+
+    def cancelled(self, loi):
+        return loi is not None and len(loi)>3 and loi[3]
+
+    def forward(self, read, N, work, loi=None):
+        zi = None
+        pos = 0
+        for x in self.segments(read, N):
+            if self.cancelled(loi): return False
+            if not x.size: continue
+            if zi is None:
+                zi = self.zi*x[0]
+            (y, zi) = signal.sosfilt(self.sos, x, zi=zi)
+            work[pos:pos+y.size] = y
+            pos += y.size
+        return True
+
+    def backward(self, work, N, write, loi=None):
+        # write(start, y) puts y at samples [start, start+y.size) of the output
+        p = self.getPadding(N)
+        zi = self.zi*work[-1]
+        for e in range(work.size,0,-self.blockSize):
+            if self.cancelled(loi): return False
+            s = max(0,e-self.blockSize)
+            (y, zi) = signal.sosfilt(self.sos, work[s:e][::-1], zi=zi)
+            y = y[::-1]
+            # drop the padding
+            (a, b) = (max(s,p), min(e,p+N))
+            if b>a:
+                write(a-p, y[a-s:b-s])
+        return True
+
+    def process(self, read, N, write, workPath, loi=None):
+        # False if loi[3] was set, it is checked before every block
+        work = np.lib.format.open_memmap(workPath, mode='w+',
+            dtype=np.float64, shape=(self.getWorkSize(N),))
+        try:
+            return self.forward(read, N, work, loi) and self.backward(work, N, write, loi)
+        finally:
+            del work
+            os.remove(workPath)
+
+def filterData(data, sos):
+    # operation of virtual filter tracks, the whole track at once
+    return signal.sosfiltfilt(np.asarray(sos), data, axis=-1)
+
+def filterSource(source, target, loi, sos):
+    # filterData block by block, see storage.evaluateSource
+    return processFilter(source, target, np.asarray(sos), loi=loi)
+
+filterData.stream = filterSource
+
+def processFilter(source, target, sos, chunked=False, loi=None):
+    '''
+    Filter the track at source into a new track at target (sourceDir, guid),
+    the output is written block by block into its memory-mapped file.
+    None if loi[3] was set before the end, the output is removed then.
+    '''
+    (sourceDir, guid) = target
+    data = storage.openSource(source)
+    N = data.shape[-1]
+    out = storage.createTrack(sourceDir, guid, N, np.float64)
+    def write(start, y):
+        out[0,start:start+y.size] = y
+    done = SOSFilter(sos).process(lambda start, stop: data[0,start:stop], N, write,
+        storage.trackPath(sourceDir, guid+WORKSUFFIX), loi)
+    out.flush()
+    del out
+    if not done:
+        storage.removeTrack(sourceDir, guid)
+        return None
+    if chunked:
+        storage.compactTrack(sourceDir, guid)
+    return guid
@@ -1,7 +1,11 @@
 from PyQt4 import QtGui
-from scipy import signal
-import numpy as np
+import uuid
+from rdsp import gl, storage
 from rdsp.module import SignalContainer
+from rdsp.modules.Filter.engine import design, processFilter
+from rdsp.parallel import runTasks
+
+FILTEROP = 'rdsp.modules.Filter.engine.filterData'
 
 class FilterModule(SignalContainer):
     ModuleName = 'Filter'
@@ -18,11 +22,11 @@ class FilterModule(SignalContainer):
         cfgWin = FilterConfig(config)
         cfgWin.exec_()
         if cfgWin.result():
-            self.processNow(cfgWin.getResult())
-            return True
+            return self.processNow(cfgWin.getResult())
         return False
 
     def processNow(self, config):
+        # False when cancelled, nothing is added then
         tracks = []
 
         # wp, ws: pass band freq & stop band freq
@@ -32,26 +36,71 @@ class FilterModule(SignalContainer):
         # b, a: dont know what & dont either
         #-> b, a = butter(N,Wn)
         #-> y = filtfilt(b,a,x)
+        # now second-order sections, y = sosfiltfilt(sos,x) in blocks
         # in fact the Wn is close to wp/(sr/2)
         # so how to determine the order, for default setting?
         if config['type'] in ('lowpass','highpass'):
-            w = config['freq']
+            w = (config['freq'],)
         else:
-            w = np.array(config['band'])
-        
-        for guid in config['tracks']:
-            t = self.parent.getTrack(guid)
-            Wn = w/(t.config['bandwidth']*2.56/2)
-            b, a = signal.butter(config['order'],Wn,config['type'])
-            r = signal.filtfilt(b,a,t.getData()[0])
+            w = tuple(config['band'])
+
+        sources = [self.parent.getTrack(guid) for guid in config['tracks']]
+        designs = []
+        for t in sources:
+            nyq = t.config['bandwidth']*2.56/2
+            Wn = tuple(f/nyq for f in w)
+            designs.append(design(config['order'],config['type'],Wn if len(Wn)>1 else Wn[0]))
+
+        if config['virtual']:
+            # only the recipe is kept, filtered when the data is asked for
+            for (t, sos) in zip(sources, designs):
+                tracks.append({
+                    'name':t.name,
+                    'config':t.config,
+                    'recipe':{
+                        'source':t.guid,
+                        'op':FILTEROP,
+                        'params':{'sos':sos.tolist()}
+                    }
+                })
+            self.addTracks(tracks)
+            return True
+
+        # one task per track in the process pool, each streams its track
+        # into the new track's file, only one block of samples is in memory
+        if not gl.projectManager.evaluateTracks(sources):
+            return False
+        guids = [str(uuid.uuid4()) for t in sources]
+        tasks = [
+            (t.getSource(), gl.projectManager.getTrackSource(guid), sos, gl.projectManager.CHUNKED)
+            for (t, guid, sos) in zip(sources, guids, designs)
+        ]
+
+        def funcname(loi):
+            runTasks(processFilter, tasks, loi)
+            loi[2] = 1
+
+        loi = [len(tasks),0,0,False,None]
+        gl.progressManager.startNewProgress('Filter %s' % self.name,funcname,loi)
+        if loi[3]:
+            # tasks running at cancel still finish, drop every output
+            for guid in guids:
+                try:
+                    storage.removeTrack(*gl.projectManager.getTrackSource(guid))
+                except FileNotFoundError:
+                    pass
+            return False
+
+        for (t, newGuid) in zip(sources, guids):
             tracks.append({
+                'guid':newGuid,
                 'name':t.name,
-                'data':np.array([r]),
                 'config':t.config
             })
 
         self.addTracks(tracks)
-        
+        return True
+
 
 class FilterConfig(QtGui.QDialog):
     def __init__(self, config):
@@ -116,10 +165,13 @@ class FilterConfig(QtGui.QDialog):
         self.highFreq = txtHighFreq
         self.name_txt = txtName
         self.order_txt = txtOrder
+        chkVirtual = QtGui.QCheckBox('Virtual Track')
+        chkVirtual.setChecked(False)
+        self.virtual_chk = chkVirtual
 
         layoutMain = QtGui.QVBoxLayout(self)
         layoutMain.aw(lblName).aw(txtName).aw(
-            lblOrder).aw(txtOrder).aw(grpFreq).aw(btnTrack).aw(tblTrack).aw(buttonBox)
+            lblOrder).aw(txtOrder).aw(grpFreq).aw(chkVirtual).aw(btnTrack).aw(tblTrack).aw(buttonBox)
 
     def addTrack(self, guid=None):
         tt = self.track_table
@@ -149,5 +201,6 @@ class FilterConfig(QtGui.QDialog):
             'type':('lowpass','highpass','bandpass','bandstop')[idx],
             'band':(self.lowFreq.value(),self.highFreq.value()),
             'freq':self.crtFreq.value(),
+            'virtual':self.virtual_chk.isChecked(),
             'tracks':tracks
         }
\ No newline at end of file
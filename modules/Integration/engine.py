@@ -0,0 +1,26 @@
+from scipy import integrate
+import numpy as np
+
+def integrateData(data, order, type, sr):
+    '''
+    order times integrated (1,N) data, in time domain ('td', with the
+    linear trend removed each time) or frequency domain ('fd')
+    '''
+    dt = data[0]
+    if type=='td':
+        x = np.arange(dt.size)/sr
+        for i in np.arange(order)+1:
+            dt = integrate.cumulative_trapezoid(dt,x,initial=0)
+            dt -= np.polyval(np.polyfit(x,dt,1),x)
+            # dt -= np.polyval(np.polyfit(x,dt,i),x)
+    else:
+        N = dt.size
+        freqs = np.fft.fftfreq(N,1/sr)
+        a = freqs*1j*2*np.pi
+        fdt = np.fft.fft(dt)
+        b = np.zeros(N,dtype='complex')
+        b[1:N] = a[1:N]**(-order)
+        fdt *= b
+        dt = np.real(np.fft.ifft(fdt))
+        # dt -= np.polyval(np.polyfit(x,dt,order),x)
+    return np.array([dt])
@@ -1,7 +1,8 @@
 from PyQt4 import QtGui
-from scipy import integrate
-import numpy as np
 from rdsp.module import SignalContainer
+from rdsp.modules.Integration.engine import integrateData
+
+INTEGRATIONOP = 'rdsp.modules.Integration.engine.integrateData'
 
 class IntegrationModule(SignalContainer):
     ModuleName = 'Integration'
@@ -24,28 +25,21 @@ class IntegrationModule(SignalContainer):
         
         for t in config['trackSet']:
             track = self.parent.getTrack(t['guid'])
-            (x,y) = track.getPlotData()
-            dt = y
-            if t['type']=='td':
-                for i in np.arange(t['order'])+1:
-                    dt = integrate.cumtrapz(dt,x,initial=0)
-                    dt -= np.polyval(np.polyfit(x,dt,1),x)
-                    # dt -= np.polyval(np.polyfit(x,dt,i),x)
-            else:
-                N = dt.size
-                freqs = np.fft.fftfreq(N,1/(track.config['bandwidth']*2.56))
-                a = freqs*1j*2*np.pi
-                fdt = np.fft.fft(dt)
-                b = np.zeros(N,dtype='complex')
-                b[1:N] = a[1:N]**(-t['order'])
-                fdt *= b
-                dt = np.real(np.fft.ifft(fdt))
-                # dt -= np.polyval(np.polyfit(x,dt,t['order']),x)
-            tracks.append({
+            params = {
+                'order':t['order'],
+                'type':t['type'],
+                'sr':track.getSampleRate()
+            }
+            tc = {
                 'name':track.name,
-                'data':np.array([dt]),
                 'config':track.config # should modify the unit
-            })
+            }
+            if config['virtual']:
+                # only the recipe is kept, integrated when the data is asked for
+                tc['recipe'] = {'source':track.guid, 'op':INTEGRATIONOP, 'params':params}
+            else:
+                tc['data'] = integrateData(track.getData(), **params)
+            tracks.append(tc)
 
         self.addTracks(tracks)
 
@@ -72,9 +66,12 @@ class IntegrationConfig(QtGui.QDialog):
         tblTrack.verticalHeader().sectionDoubleClicked.connect(self.removeTrack)
         self.track_table = tblTrack
         self.name_txt = txtName
+        chkVirtual = QtGui.QCheckBox('Virtual Track')
+        chkVirtual.setChecked(False)
+        self.virtual_chk = chkVirtual
 
         layoutMain = QtGui.QVBoxLayout(self)
-        layoutMain.aw(lblName).aw(txtName).aw(btnTrack).aw(tblTrack).aw(buttonBox)
+        layoutMain.aw(lblName).aw(txtName).aw(chkVirtual).aw(btnTrack).aw(tblTrack).aw(buttonBox)
 
     def addTrack(self):
         tt = self.track_table
@@ -111,5 +108,6 @@ class IntegrationConfig(QtGui.QDialog):
 
         return {
             'name':self.name_txt.text(),
+            'virtual':self.virtual_chk.isChecked(),
             'trackSet':trackSet
         }
\ No newline at end of file
@@ -24,14 +24,21 @@ class InterceptionModule(SignalContainer):
 
         for guid in config['tracks']:
             track = self.parent.getTrack(guid)
-            (x,y) = track.getPlotData()
-            idx0 = np.searchsorted(x,config['start'])
-            idx1 = np.searchsorted(x,config['stop'])
-            tracks.append({
+            # samples are at i/sr, the first at or after start/stop
+            sr = track.getSampleRate()
+            N = track.getSize()
+            idx0 = min(N,max(0,int(np.ceil(config['start']*sr))))
+            idx1 = min(N,max(idx0,int(np.ceil(config['stop']*sr))))
+            tc = {
                 'name':track.name,
-                'data':np.array([y[idx0:idx1]]),
                 'config':track.config
-            })
+            }
+            if config['virtual']:
+                # a view on the parent's samples, nothing is copied
+                tc['recipe'] = {'source':guid, 'offset':idx0, 'length':idx1-idx0}
+            else:
+                tc['data'] = np.array(track.getData(idx0,idx1))
+            tracks.append(tc)
 
         self.addTracks(tracks)
 
@@ -68,10 +75,13 @@ class InterceptionConfig(QtGui.QDialog):
         self.name_txt = txtName
         self.start_txt = txtStart
         self.stop_txt = txtStop
+        chkVirtual = QtGui.QCheckBox('Virtual Track')
+        chkVirtual.setChecked(True)
+        self.virtual_chk = chkVirtual
 
         layoutMain = QtGui.QVBoxLayout(self)
         layoutMain.aw(lblName).aw(txtName).aw(lblStart).aw(txtStart).aw(
-            lblStop).aw(txtStop).aw(btnTrack).aw(tblTrack).aw(buttonBox)
+            lblStop).aw(txtStop).aw(chkVirtual).aw(btnTrack).aw(tblTrack).aw(buttonBox)
 
     def addTrack(self):
         tt = self.track_table
@@ -97,5 +107,6 @@ class InterceptionConfig(QtGui.QDialog):
             'tracks':tracks,
             'start':self.start_txt.value(),
             'stop':self.stop_txt.value(),
-            'name':self.name_txt.text()
+            'name':self.name_txt.text(),
+            'virtual':self.virtual_chk.isChecked()
         }
\ No newline at end of file
@@ -0,0 +1,3 @@
+from rdsp.modules.Octave.main import OctaveModule as RDSP_Module, OctaveBandModule
+RDSP_Modules = [OctaveBandModule]
+ISREADY = True
\ No newline at end of file
@@ -0,0 +1,116 @@
+import numpy as np
+from scipy import signal
+from rdsp import storage
+
+BLOCKSIZE = 1<<20 # samples of the track filtered at once
+FRACTIONS = ('1/1','1/3')
+EDGE = 0.4 # highest band edge kept at a rate, as part of that rate
+
+def getBands(fraction, fmin, fmax, sr):
+    '''
+    (centre, lower, upper) of the base-10 fractional-octave bands
+    between fmin and fmax, the upper edge below EDGE*sr
+    '''
+    b = int(fraction.split('/')[1])
+    G = 10**(3/10)
+    x0 = int(np.floor(b*np.log(fmin/1000)/np.log(G)))
+    x1 = int(np.ceil(b*np.log(fmax/1000)/np.log(G)))
+    fc = 1000*G**(np.arange(x0,x1+1)/b)
+    lower = fc*G**(-1/(2*b))
+    upper = fc*G**(1/(2*b))
+    keep = (fc>=fmin/G**(1/(2*b))) & (fc<=fmax*G**(1/(2*b))) & (upper<EDGE*sr)
+    return (fc[keep], lower[keep], upper[keep])
+
+class FilterBank(object):
+    '''
+    All bands of a track in one pass, causal filters with state
+    carried from block to block. With multirate the signal is halved
+    stage by stage and each band runs at the lowest rate that holds it.
+    Output is the RMS of every band over intervals of the same length.
+    '''
+    def __init__(self, fraction, fmin, fmax, sr, order=3, interval=0.125, multirate=True):
+        (self.fc, self.lower, self.upper) = getBands(fraction, fmin, fmax, sr)
+        self.sr = sr
+        n = len(self.fc)
+        # stage of each band, 0 is the track rate
+        if multirate and n:
+            ratio = EDGE*sr/self.upper
+            self.stage = np.maximum(0,np.floor(np.log2(ratio))).astype(int)
+        else:
+            self.stage = np.zeros(n, dtype=int)
+        self.stages = int(self.stage.max())+1 if n else 1
+        # interval in samples, a multiple of every decimation
+        D = 2**(self.stages-1)
+        self.step = max(1,int(round(interval*sr/D)))*D
+        self.interval = self.step/sr
+
+        self.sos = []
+        for i in range(n):
+            nyq = sr/2**self.stage[i]/2
+            self.sos.append(signal.butter(order, (self.lower[i]/nyq, self.upper[i]/nyq),
+                'bandpass', output='sos'))
+        # halfband anti-alias before every decimation
+        self.aa = signal.ellip(8, 0.01, 80, 0.45, output='sos')
+
+    def getStageSize(self, N, k):
+        return (N+2**k-1)//2**k
+
+    def getFrameCount(self, N):
+        return N//self.step
+
+    def process(self, read, N, waves=None, blockSize=BLOCKSIZE):
+        '''
+        RMS (bands, frames) of the track of N samples,
+        waves[i] (optional) receives band i at its stage rate
+        '''
+        n = len(self.fc)
+        frames = self.getFrameCount(N)
+        acc = np.zeros((n,frames))
+        zb = [np.zeros((len(sos),2)) for sos in self.sos]
+        za = [np.zeros((len(self.aa),2)) for k in range(self.stages)]
+        pos = np.zeros(self.stages, dtype=np.int64) # samples seen per stage
+        bands = [np.nonzero(self.stage==k)[0] for k in range(self.stages)]
+
+        for s0 in range(0,N,blockSize):
+            x = np.asarray(read(s0,min(N,s0+blockSize)), dtype=np.float64)
+            for k in range(self.stages):
+                p0 = pos[k]
+                if not x.size: break
+                # sums of squares per interval, an interval may span blocks
+                fStep = self.step>>k
+                starts = np.arange((-p0)%fStep,x.size,fStep)
+                if not starts.size or starts[0]: starts = np.append(0,starts)
+                idx = (p0+starts)//fStep
+                ok = idx<frames
+                for i in bands[k]:
+                    (y, zb[i]) = signal.sosfilt(self.sos[i], x, zi=zb[i])
+                    if waves is not None:
+                        waves[i][p0:p0+y.size] = y
+                    acc[i][idx[ok]] += np.add.reduceat(y**2, starts)[ok]
+                pos[k] += x.size
+                if k+1<self.stages:
+                    (x, za[k]) = signal.sosfilt(self.aa, x, zi=za[k])
+                    x = x[(-p0)%2::2]
+        counts = np.array([self.step>>k for k in self.stage])[:,None]
+        return np.sqrt(acc/counts)
+
+def processBank(source, params, rmsPath, wavePaths=None):
+    '''
+    Worker task: one track through the FilterBank of params,
+    RMS saved to rmsPath, band waveforms to wavePaths if given
+    '''
+    bank = FilterBank(*params)
+    data = storage.openSource(source)
+    N = data.shape[-1]
+    waves = None
+    if wavePaths is not None:
+        waves = [
+            np.lib.format.open_memmap(p, mode='w+', dtype=np.float64,
+                shape=(bank.getStageSize(N,k),))
+            for (p, k) in zip(wavePaths, bank.stage)
+        ]
+    rms = bank.process(lambda start, stop: data[0,start:stop], N, waves)
+    np.save(rmsPath, rms)
+    if waves is not None:
+        for w in waves: w.flush()
+    return rms.shape
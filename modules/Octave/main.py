@@ -0,0 +1,390 @@
+from rdsp import gl
+from PyQt4 import QtGui
+from rdsp.module import ModuleType, ModuleBase
+from rdsp.modules.Octave.engine import FilterBank, FRACTIONS, processBank
+from rdsp.parallel import runTasks
+import numpy as np
+
+RMSSUFFIX = '-rms' # result key of the band RMS of a track
+WAVESUFFIX = '-band%d' # result key of the waveform of band i
+
+class OctaveModule(ModuleBase):
+    '''
+    Fractional-octave band levels, every band of a track in one pass,
+    band waveforms are kept only if asked for
+    '''
+    ModuleName = 'Octave'
+    ContextMenu = [
+        {'title':'Process', 'action':'processNow'},
+        {'title':'Force Process', 'action':'processForce'},
+        {'title':'Config', 'action':'setConfig'},
+        {'title':'Delete', 'action':'delete'}
+    ]
+    def __init__(self, guid, name, parent, processed=False):
+        super().__init__(guid,name,parent)
+        self.tracks = []
+        self.bands = []
+        self.config = {
+            'fraction':'1/3',
+            'fmin':20.0,
+            'fmax':1000.0,
+            'order':3,
+            'interval':0.125,
+            'multirate':True,
+            'waveforms':False
+        }
+        self.processed = processed
+
+    def getResult(self):
+        # {track guid: info}
+        return gl.dataCache.get(('result',self.guid),
+            lambda: gl.projectManager.loadResultMeta(self.guid))
+
+    def getBandData(self, guid):
+        # {'fc','lower','upper','sr','interval','waveforms','rms'}
+        if self.processed:
+            result = dict(self.getResult()[guid])
+            key = guid+RMSSUFFIX
+            result['rms'] = gl.dataCache.get(('result',self.guid,key),
+                lambda: gl.projectManager.loadResultArray(self.guid, key, False))
+            return result
+        return {}
+
+    def getWaveform(self, guid, i):
+        return gl.projectManager.loadResultArray(self.guid, guid+WAVESUFFIX % i)
+
+    def configWindow(self, config=None):
+        if not config:
+            config = dict(self.config)
+            config['name'] = self.name
+            config['trackSrc'] = self.parent.getTracksList()
+            config['tracks'] = []
+
+        cfgWin = OctaveConfig(config)
+        cfgWin.exec_()
+        if cfgWin.result():
+            self.parseConfig(cfgWin.getResult())
+            return True
+        return False
+
+    def getProperty(self):
+        return {
+            'Fraction':self.config['fraction'],
+            'Frequency':'%g - %g' % (self.config['fmin'],self.config['fmax']),
+            'Order':self.config['order'],
+            'Interval':self.config['interval'],
+            'Multirate':self.config['multirate'],
+            'Waveforms':self.config['waveforms']
+        }
+
+    def parseConfig(self, config):
+        if 'name' in config:
+            self.name = config['name']
+        self.config = {
+            'fraction':config['fraction'],
+            'fmin':config['fmin'],
+            'fmax':config['fmax'],
+            'order':config['order'],
+            'interval':config['interval'],
+            'multirate':config['multirate'],
+            'waveforms':config['waveforms']
+        }
+        self.tracks = [
+            self.parent.getTrack(guid) for guid in config['tracks']
+        ]
+        if 'bands' in config:
+            self.bands = [
+                OctaveBandModule(guid, self.parent.getTrack(guid).name, self) for guid in config['bands']
+            ]
+
+    def getListConfig(self):
+        config = {
+            'type':self.ModuleName,
+            'name':self.name,
+            'object':self,
+            'sub':[band.getListConfig() for band in self.bands]
+        }
+        return config
+
+    def getFileConfig(self):
+        config = {
+            'type':self.ModuleName,
+            'guid':self.guid,
+            'name':self.name,
+            'processed':self.processed,
+            'fingerprint':self.fingerprint,
+            'config':dict(self.config,
+                tracks=[track.guid for track in self.tracks],
+                bands=[band.guid for band in self.bands]
+            )
+        }
+        return config
+
+    def setConfig(self):
+        cfg = self.getFileConfig()['config']
+        cfg['name'] = self.name
+        cfg['trackSrc'] = self.parent.getTracksList()
+        if self.configWindow(cfg):
+            gl.projectManager.saveNode(self)
+
+    def delete(self):
+        self.parent.removeProcess(self)
+        if self.processed:
+            gl.projectManager.removeResult(self.guid)
+
+    def processForce(self):
+        self.processNow(True)
+
+    def processNow(self, force=False):
+        cfg = self.config
+        fingerprint = self.getFingerprint(cfg, self.tracks)
+        if self.processed and not force and fingerprint==self.fingerprint:
+            gl.progressManager.showMessage('%s: result is up to date' % self.name)
+            return
+        # virtual inputs are evaluated under a progress bar, not by every task
+        if not gl.projectManager.evaluateTracks(self.tracks):
+            return
+
+        self.bands.clear()
+        if self.processed:
+            gl.projectManager.removeResult(self.guid)
+            self.processed = False
+
+        # the filter state is sequential, tracks are the unit of parallel work
+        result = {}
+        tasks = []
+        # made here, the workers save into it
+        gl.projectManager.getResultDir(self.guid)
+        for track in self.tracks:
+            sr = track.getSampleRate()
+            params = (cfg['fraction'], cfg['fmin'], cfg['fmax'], sr,
+                cfg['order'], cfg['interval'], cfg['multirate'])
+            bank = FilterBank(*params)
+            result[track.guid] = {
+                'fc':bank.fc.tolist(),
+                'lower':bank.lower.tolist(),
+                'upper':bank.upper.tolist(),
+                'sr':(sr/2**bank.stage).tolist(),
+                'interval':bank.interval,
+                'waveforms':cfg['waveforms']
+            }
+            wavePaths = None
+            if cfg['waveforms']:
+                wavePaths = [
+                    gl.projectManager.getResultPath(self.guid, track.guid+WAVESUFFIX % i)
+                    for i in range(len(bank.fc))
+                ]
+            tasks.append((track.getSource(), params,
+                gl.projectManager.getResultPath(self.guid, track.guid+RMSSUFFIX), wavePaths))
+
+        def funcname(loi):
+            runTasks(processBank, tasks, loi)
+            loi[2] = 1
+
+        loi = [len(tasks),0,0,False,None]
+        gl.progressManager.startNewProgress('Octave %s' % self.name,funcname,loi)
+        if loi[3]:
+            gl.projectManager.removeResult(self.guid)
+            self.parent.refresh(self)
+            return
+
+        for track in self.tracks:
+            self.bands.append(OctaveBandModule(track.guid, track.name, self))
+
+        gl.projectManager.saveResultMeta(self.guid, result)
+        gl.dataCache.put(('result',self.guid), result)
+
+        self.processed = True
+        self.fingerprint = fingerprint
+        self.parent.refresh(self)
+
+class OctaveConfig(QtGui.QDialog):
+    def __init__(self, config):
+        super().__init__()
+        self.config = config
+        self.setWindowTitle('Octave Configuration')
+        self.initUI()
+
+    def initUI(self):
+        config = self.config
+        buttonBox = QtGui.QDialogButtonBox(QtGui.QDialogButtonBox.Ok | QtGui.QDialogButtonBox.Cancel)
+        buttonBox.accepted.connect(self.accept)
+        buttonBox.rejected.connect(self.reject)
+
+        lblName = QtGui.QLabel('Name')
+        txtName = QtGui.QLineEdit(config['name'])
+
+        lblFraction = QtGui.QLabel('Fraction')
+        cmbFraction = QtGui.QComboBox()
+        cmbFraction.addItems(FRACTIONS)
+        cmbFraction.setCurrentIndex(FRACTIONS.index(config['fraction']))
+
+        lblFreq = QtGui.QLabel('Frequency (Hz)')
+        txtFmin = QtGui.QDoubleSpinBox()
+        txtFmax = QtGui.QDoubleSpinBox()
+        for txt in (txtFmin, txtFmax):
+            txt.setRange(0.1,100000)
+            txt.setDecimals(1)
+        txtFmin.setValue(config['fmin'])
+        txtFmax.setValue(config['fmax'])
+        layoutFreq = QtGui.QHBoxLayout()
+        layoutFreq.addWidget(txtFmin)
+        layoutFreq.addWidget(txtFmax)
+
+        lblOrder = QtGui.QLabel('Order')
+        txtOrder = QtGui.QSpinBox()
+        txtOrder.setRange(1,10)
+        txtOrder.setValue(config['order'])
+
+        lblInterval = QtGui.QLabel('Interval (s)')
+        txtInterval = QtGui.QDoubleSpinBox()
+        txtInterval.setRange(0.01,60)
+        txtInterval.setDecimals(3)
+        txtInterval.setValue(config['interval'])
+
+        chkMultirate = QtGui.QCheckBox('Multirate')
+        chkMultirate.setChecked(config['multirate'])
+        chkWaveforms = QtGui.QCheckBox('Keep Waveforms')
+        chkWaveforms.setChecked(config['waveforms'])
+
+        btnTrack = QtGui.QCommandLinkButton('Add Track')
+        btnTrack.clicked.connect(self.addTrack)
+        tblTrack = QtGui.QTableWidget(0,1)
+        tblTrack.setHorizontalHeaderLabels(['Track Name'])
+        tblTrack.verticalHeader().sectionDoubleClicked.connect(self.removeTrack)
+        self.track_table = tblTrack
+        for track in config['tracks']:
+            self.addTrack(track)
+
+        layoutMain = QtGui.QVBoxLayout()
+        layoutMain.addWidget(lblName)
+        layoutMain.addWidget(txtName)
+        layoutMain.addWidget(lblFraction)
+        layoutMain.addWidget(cmbFraction)
+        layoutMain.addWidget(lblFreq)
+        layoutMain.addLayout(layoutFreq)
+        layoutMain.addWidget(lblOrder)
+        layoutMain.addWidget(txtOrder)
+        layoutMain.addWidget(lblInterval)
+        layoutMain.addWidget(txtInterval)
+        layoutMain.addWidget(chkMultirate)
+        layoutMain.addWidget(chkWaveforms)
+        layoutMain.addWidget(btnTrack)
+        layoutMain.addWidget(tblTrack)
+        layoutMain.addWidget(buttonBox)
+        self.setLayout(layoutMain)
+
+        self.name_txt = txtName
+        self.fraction_cmb = cmbFraction
+        self.fmin_txt = txtFmin
+        self.fmax_txt = txtFmax
+        self.order_txt = txtOrder
+        self.interval_txt = txtInterval
+        self.multirate_chk = chkMultirate
+        self.waveforms_chk = chkWaveforms
+
+    def addTrack(self, guid=None):
+        tt = self.track_table
+        n = tt.rowCount()
+        tt.setRowCount(n+1)
+        trackSrc = self.config['trackSrc']
+
+        cmbTracks = QtGui.QComboBox()
+        tracks = [track['name'] for track in trackSrc]
+        cmbTracks.addItems(tracks)
+
+        tt.setCellWidget(n,0,cmbTracks)
+
+        if guid:
+            for i in range(len(tracks)):
+                if guid==trackSrc[i]['guid']:
+                    cmbTracks.setCurrentIndex(i)
+                    break
+
+    def removeTrack(self, index):
+        self.track_table.removeRow(index)
+
+    def getResult(self):
+        tt = self.track_table
+        trackSrc = self.config['trackSrc']
+        tracks = []
+        for i in range(tt.rowCount()):
+            tracks.append(trackSrc[tt.cellWidget(i,0).currentIndex()]['guid'])
+
+        return {
+            'name':self.name_txt.text(),
+            'fraction':self.fraction_cmb.currentText(),
+            'fmin':self.fmin_txt.value(),
+            'fmax':self.fmax_txt.value(),
+            'order':self.order_txt.value(),
+            'interval':self.interval_txt.value(),
+            'multirate':self.multirate_chk.isChecked(),
+            'waveforms':self.waveforms_chk.isChecked(),
+            'tracks':tracks
+        }
+
+class OctaveBandModule(ModuleBase):
+    ModuleName = 'OctaveBand'
+    ModuleType = ModuleType.config
+    ContextMenu = [
+        {'title':'Show Spectrum', 'action':'showSpectrum'},
+        {'title':'Show History', 'action':'showHistory'},
+        {'title':'Show Waveform', 'action':'showWaveform'}
+    ]
+    def __init__(self, guid, name, parent):
+        super().__init__(guid,name,parent)
+        self.config = {}
+        self.track = self.parent.parent.getTrack(self.guid)
+
+    def getData(self):
+        return self.parent.getBandData(self.guid)
+
+    def getListConfig(self):
+        cfg = {
+            'type':self.ModuleName,
+            'name':self.name,
+            'object':self,
+            'sub':[
+                self.track.getListConfig()
+            ]
+        }
+        return cfg
+
+    def getFileConfig(self):
+        pass
+
+    def parseConfig(self, config):
+        pass
+
+    def getProperty(self):
+        return {}
+
+    def pickBand(self, result):
+        bands = ['%g Hz' % fc for fc in result['fc']]
+        item, ok = QtGui.QInputDialog.getItem(None,'Band','Band:',bands,editable=False)
+        return bands.index(item) if ok else None
+
+    def showSpectrum(self):
+        # level of every band over the whole track
+        result = self.getData()
+        y = np.sqrt(np.mean(result['rms']**2,axis=1))
+        gl.plotManager.plotNew((self.name,np.array(result['fc']),y))
+
+    def showHistory(self):
+        result = self.getData()
+        i = self.pickBand(result)
+        if i is None: return
+        y = result['rms'][i]
+        x = (np.arange(y.size)+0.5)*result['interval']
+        gl.plotManager.plotNew(('%s %g Hz' % (self.name,result['fc'][i]),x,y))
+
+    def showWaveform(self):
+        result = self.getData()
+        if not result['waveforms']:
+            QtGui.QMessageBox.warning(None,'Waveform','Waveforms were not kept, check "Keep Waveforms" and process again.')
+            return
+        i = self.pickBand(result)
+        if i is None: return
+        y = self.parent.getWaveform(self.guid, i)
+        x = np.arange(y.size)/result['sr'][i]
+        gl.plotManager.plotNew(('%s %g Hz' % (self.name,result['fc'][i]),x,y))
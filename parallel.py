@@ -0,0 +1,35 @@
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+def runTasks(func, tasks, loi, onDone=None):
+    '''
+    Run func(*task) for every task in a process pool.
+    loi is the list of ProgressManager, loi[1] counts finished tasks,
+    loi[3] set to True cancels the tasks not started yet.
+    onDone(index, result) is called in the calling thread.
+    Returns the results in task order, None for cancelled ones.
+    An exception of a task cancels the rest and is raised again here,
+    with the message in loi[4].
+    '''
+    results = [None]*len(tasks)
+    with ProcessPoolExecutor() as pool:
+        futures = {pool.submit(func,*task):i for i,task in enumerate(tasks)}
+        pending = set(futures)
+        while pending:
+            (done, pending) = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = futures[future]
+                try:
+                    results[i] = future.result()
+                except Exception as e:
+                    for future in pending:
+                        future.cancel()
+                    if len(loi)>4: loi[4] = 'task %d failed: %s' % (i, e)
+                    raise
+                loi[1] += 1
+                if onDone is not None: onDone(i, results[i])
+            if len(loi)>3 and loi[3]:
+                # running tasks finish, the pool waits for them on exit
+                for future in pending:
+                    future.cancel()
+                break
+    return results
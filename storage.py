@@ -0,0 +1,173 @@
+from os import path
+import os, zipfile, importlib
+import numpy as np
+
+# track storage under the project's source/,
+# plain functions so worker processes can use them without a ProjectManager
+EXTENSION = '.npy'
+CHUNKEXTENSION = '.npz'
+CHUNKSIZE = 1<<20 # samples per chunk
+RECIPE = 'recipe' # tag of the source of a derived track, see openSource
+VIEW = 'view' # tag of the source of a window of another track
+
+def trackPath(sourceDir, guid):
+    return path.join(sourceDir,guid+EXTENSION)
+
+def chunkedTrackPath(sourceDir, guid):
+    return path.join(sourceDir,guid+CHUNKEXTENSION)
+
+def saveTrack(sourceDir, guid, data, chunked=False):
+    if chunked:
+        saveChunked(chunkedTrackPath(sourceDir,guid),data)
+    else:
+        np.save(trackPath(sourceDir,guid),data)
+
+def createTrack(sourceDir, guid, n, dtype=np.float64):
+    # (1,n) .npy opened for writing, filled in place by the caller
+    return np.lib.format.open_memmap(trackPath(sourceDir,guid),mode='w+',dtype=dtype,shape=(1,n))
+
+def compactTrack(sourceDir, guid):
+    # a .npy track rewritten in the chunked format
+    filePath = trackPath(sourceDir,guid)
+    saveChunked(chunkedTrackPath(sourceDir,guid),np.load(filePath,mmap_mode='r'))
+    os.remove(filePath)
+
+def loadTrack(sourceDir, guid, mmapMode=None):
+    # the format is told by the file found, old projects only have .npy
+    filePath = trackPath(sourceDir,guid)
+    if path.exists(filePath):
+        return np.load(filePath,mmap_mode=mmapMode)
+    track = ChunkedTrack(chunkedTrackPath(sourceDir,guid))
+    if mmapMode is None:
+        data = track[:,:]
+        track.close()
+        return data
+    return track
+
+def openSource(source):
+    '''
+    source from ProjectManager.getTrackSource, opened memory-mapped,
+    or (RECIPE, source, op, params) from TrackModule.getSource
+    for a derived track, evaluated from the track it derives from,
+    or (VIEW, source, offset, length) for a window of samples of a track
+    '''
+    if source[0]==RECIPE:
+        (tag, parent, op, params) = source
+        return applyOperation(op, openSource(parent), params)
+    if source[0]==VIEW:
+        (tag, parent, offset, length) = source
+        return openSource(parent)[:,offset:offset+length]
+    (sourceDir, guid) = source
+    return loadTrack(sourceDir, guid, 'r')
+
+def evaluateSource(source, target, loi=None):
+    '''
+    (RECIPE, source, op, params) stored as a plain track at target
+    (sourceDir, guid). An operation with a stream attribute,
+    stream(source, target, loi, **params), writes it block by block
+    and stops once loi[3] is set, any other is applied to the whole track.
+    False if cancelled, nothing is left at target then.
+    '''
+    (tag, parent, op, params) = source
+    func = getOperation(op)
+    if hasattr(func, 'stream'):
+        return func.stream(parent, target, loi, **params) is not None
+    saveTrack(target[0], target[1], func(openSource(parent), **params))
+    return True
+
+def getOperation(op):
+    # op is the dotted path of a function(data, **params) -> (1,N) data
+    # of the same length, imported by name so worker processes find it too
+    (module, name) = op.rsplit('.',1)
+    return getattr(importlib.import_module(module), name)
+
+def applyOperation(op, data, params):
+    return getOperation(op)(data, **params)
+
+def getStamp(sourceDir, guid):
+    # (size, mtime) of the stored file, changes if the track is rewritten
+    filePath = trackPath(sourceDir,guid)
+    if not path.exists(filePath):
+        filePath = chunkedTrackPath(sourceDir,guid)
+    st = os.stat(filePath)
+    return (st.st_size, st.st_mtime_ns)
+
+def findTrack(sourceDir, guid):
+    # path of the stored track, .npy or chunked
+    filePath = trackPath(sourceDir,guid)
+    if not path.exists(filePath):
+        filePath = chunkedTrackPath(sourceDir,guid)
+    return filePath
+
+def removeTrack(sourceDir, guid):
+    os.remove(findTrack(sourceDir,guid))
+
+def saveChunked(filePath, data, chunkSize=CHUNKSIZE):
+    '''
+    Zip container (readable by np.load) with one deflated member per chunk,
+    'index' holds the first sample of each chunk and the total size
+    '''
+    n = data.shape[-1]
+    index = np.append(np.arange(0,n,chunkSize),n)
+    with zipfile.ZipFile(filePath,'w',zipfile.ZIP_DEFLATED) as zf:
+        for i in range(index.size-1):
+            with zf.open('c%d.npy' % i,'w') as fp:
+                chunk = np.ascontiguousarray(data[:,index[i]:index[i+1]])
+                np.lib.format.write_array(fp,chunk)
+        with zf.open('index.npy','w') as fp:
+            np.lib.format.write_array(fp,index)
+        with zf.open('dtype.npy','w') as fp:
+            np.lib.format.write_array(fp,np.array([np.dtype(data.dtype).str]))
+
+class ChunkedTrack(object):
+    '''
+    Read-only (1,N) track in a chunk container, slicing it
+    decompresses only the chunks touched by the requested samples
+    '''
+    def __init__(self, filePath):
+        self.npz = np.load(filePath)
+        self.index = self.npz['index']
+        self.dtype = np.dtype(str(self.npz['dtype'][0]))
+        self.shape = (1,int(self.index[-1]))
+        self.size = self.shape[1]
+        self.ndim = 2
+
+    def __len__(self):
+        return 1
+
+    def close(self):
+        # the container stays open while reading, close it before removal
+        self.npz.close()
+
+    def read(self, start, stop):
+        index = self.index
+        if stop<=start:
+            return np.zeros((1,0),dtype=self.dtype)
+        i0 = np.searchsorted(index,start,'right')-1
+        i1 = np.searchsorted(index,stop,'left')
+        data = np.concatenate(
+            [self.npz['c%d' % i] for i in range(i0,i1)], axis=1
+        )
+        offset = index[i0]
+        return data[:,start-offset:stop-offset]
+
+    def __getitem__(self, key):
+        if not isinstance(key,tuple):
+            key = (key,)
+        rows = key[0]
+        cols = key[1] if len(key)>1 else slice(None)
+
+        if isinstance(cols,slice):
+            r = range(*cols.indices(self.size))
+            if len(r)==0:
+                return np.zeros((1,0),dtype=self.dtype)[rows]
+            lo = min(r[0],r[-1])
+            hi = max(r[0],r[-1])+1
+            stop = r.stop-lo
+            cols = slice(r.start-lo, stop if stop>=0 else None, r.step)
+        else:
+            cols = int(cols)
+            if cols<0: cols += self.size
+            lo, hi = cols, cols+1
+            cols = 0
+        return self.read(lo,hi)[rows,cols]
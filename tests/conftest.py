@@ -0,0 +1,17 @@
+import sys, types
+from os import path
+
+# the package is imported as rdsp, and the module packages import Qt in
+# their __init__. The engines under test do not need it, so the packages
+# are registered bare and only their plain submodules get imported.
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+PACKAGES = [('rdsp',''), ('rdsp.modules','modules')] + [
+    ('rdsp.modules.'+name, path.join('modules',name))
+    for name in ('FFT','FRF','Filter','Integration','Interception','Octave')
+]
+
+for (name, folder) in PACKAGES:
+    if name not in sys.modules:
+        package = types.ModuleType(name)
+        package.__path__ = [path.join(ROOT,folder)]
+        sys.modules[name] = package
@@ -0,0 +1,47 @@
+import numpy as np
+from rdsp.cache import DataCache
+
+def test_cache_keeps_the_budget():
+    cache = DataCache(budget=3*800)
+    for i in range(5):
+        cache.get(('track',i), lambda: np.zeros(100))
+    assert cache.size<=cache.budget
+    assert sorted(k[1] for k in cache.items)==[2,3,4]
+    # the oldest is loaded again
+    cache.get(('track',0), lambda: np.zeros(100))
+    assert cache.getStats()['misses']==6
+
+def test_cache_hit_keeps_an_item():
+    cache = DataCache(budget=2*800)
+    cache.get('a', lambda: np.zeros(100))
+    cache.get('b', lambda: np.zeros(100))
+    cache.get('a', lambda: None)
+    cache.get('c', lambda: np.zeros(100))
+    assert set(cache.items)=={'a','c'}
+
+def test_remove_prefix():
+    cache = DataCache()
+    cache.put(('result','r','a'), np.zeros(10))
+    cache.put(('result','r','b'), np.zeros(10))
+    cache.put(('result','s'), np.zeros(10))
+    cache.removePrefix(('result','r'))
+    assert list(cache.items)==[('result','s')]
+    assert cache.size==80
+
+def test_memmap_counts_nothing(tmp_path):
+    np.save(str(tmp_path/'a.npy'), np.zeros(1000))
+    cache = DataCache(budget=1)
+    cache.put('mapped', np.load(str(tmp_path/'a.npy'), mmap_mode='r'))
+    assert cache.size==0
+
+def test_cache_remove_returns_the_values():
+    cache = DataCache()
+    values = [np.zeros(10) for i in range(3)]
+    cache.put(('result','r','a'), values[0])
+    cache.put(('result','r','b'), values[1])
+    cache.put(('track','r'), values[2])
+    dropped = cache.removePrefix(('result','r'))
+    assert len(dropped)==2 and all(any(d is v for v in values) for d in dropped)
+    assert cache.remove(('track','x'))==[]
+    assert cache.remove(('track','r'))[0] is values[2]
+    assert cache.size==0 and not cache.items
@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+from rdsp.modules.FFT.engine import (STFTEngine, ZoomEngine, Averager, PEAKDTYPE,
+    checkBand, findPeaks)
+
+SR = 2560.0
+
+def tone(f, N, amp=1.0):
+    return amp*np.sin(2*np.pi*f*np.arange(N)/SR)
+
+def test_stft_reads_amplitude_at_the_tone_line():
+    engine = STFTEngine(256, 50)
+    (t0, dt, f0, df) = engine.getAxes(SR)
+    f = 40*df
+    spectra = engine.transform(tone(f, 10*engine.Nw, 2.0))
+    assert spectra.shape==(engine.getFrameCount(10*engine.Nw),engine.width)
+    assert np.allclose(np.abs(spectra[:,40]), 2.0, rtol=1e-3)
+
+def test_single_precision():
+    engine = STFTEngine(256, 50, 'hanning', 'single')
+    spectra = engine.transform(tone(100.0, 4*engine.Nw))
+    assert spectra.dtype==np.complex64
+
+def test_streamed_stft_equals_single_pass():
+    engine = STFTEngine(100, 50)
+    x = np.random.default_rng(0).standard_normal(20000)
+    N = x.size
+    whole = engine.transform(x)
+    out = np.empty((engine.getFrameCount(N),engine.width), dtype=engine.ctype)
+    # blocks of a few frames, every block boundary is crossed
+    engine.process(lambda start, stop: x[start:stop], N, out, blockSize=3*engine.Nw)
+    assert np.allclose(out, whole)
+
+def test_stft_frame_ranges_cover_the_track():
+    engine = STFTEngine(100, 70)
+    x = np.random.default_rng(1).standard_normal(30000)
+    N = x.size
+    out = np.zeros((engine.getFrameCount(N),engine.width), dtype=engine.ctype)
+    for (first, last) in engine.getTasks(N, blockSize=2*engine.Nw):
+        engine.process(lambda start, stop: x[start:stop], N, out,
+            blockSize=2*engine.Nw, first=first, last=last)
+    assert np.allclose(out, engine.transform(x))
+
+@pytest.mark.parametrize('mode', ['linear','rms','peak','exponential'])
+def test_merged_averagers_equal_one_pass(mode):
+    spectra = np.random.default_rng(2).standard_normal((50,16))
+    whole = Averager(mode, 16)
+    whole.add(spectra)
+    (first, second) = (Averager(mode, 16), Averager(mode, 16))
+    first.add(spectra[:17])
+    second.add(spectra[17:])
+    first.merge(second)
+    assert first.count==whole.count
+    assert np.allclose(first.getResult(), whole.getResult())
+
+def test_linear_and_rms_averages():
+    spectra = np.array([[1.0,-2.0],[3.0,4.0]])
+    linear = Averager('linear', 2)
+    linear.add(spectra)
+    rms = Averager('rms', 2)
+    rms.add(spectra)
+    assert np.allclose(linear.getResult(), [2.0,3.0])
+    assert np.allclose(rms.getResult(), np.sqrt([5.0,10.0]))
+
+@pytest.mark.parametrize('band', [(100,2000),(500,400),(-1,100)])
+def test_zoom_band_is_validated(band):
+    with pytest.raises(ValueError):
+        checkBand(band, SR)
+    with pytest.raises(ValueError):
+        ZoomEngine(100, 50, 'hanning', 'double', band, SR)
+
+@pytest.mark.parametrize('band', [(300,340),(0,SR/2)])
+def test_zoom_finds_the_tone(band):
+    engine = ZoomEngine(100, 50, 'hanning', 'double', band, SR)
+    f = 321.0
+    x = tone(f, 200000)
+    bb = np.empty(engine.getBasebandSize(x.size), dtype=engine.ctype)
+    engine.baseband(lambda start, stop: x[start:stop], x.size, bb)
+    spectra = engine.transform(bb[bb.size//4:])
+    (t0, dt, f0, df) = engine.getAxes()
+    line = np.abs(spectra).mean(axis=0).argmax()
+    assert abs(f0+line*df-f)<=df
+
+def test_find_peaks_of_no_frame():
+    peaks = findPeaks(np.zeros((0,100)), 5, (0.0,1.0))
+    assert peaks.dtype==PEAKDTYPE and peaks.size==0
+
+def test_find_peaks_refines_the_frequency():
+    engine = STFTEngine(256, 0)
+    (t0, dt, f0, df) = engine.getAxes(SR)
+    f = 40.3*df
+    spectra = engine.transform(tone(f, 4*engine.Nw))
+    peaks = findPeaks(spectra, 1, (f0, df))
+    assert peaks.size==spectra.shape[0]
+    assert np.all(np.abs(peaks['freq']-f)<0.1*df)
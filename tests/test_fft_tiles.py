@@ -0,0 +1,26 @@
+import numpy as np
+from rdsp.modules.FFT.tiles import TileSource, poolMax
+
+def getStft():
+    rng = np.random.default_rng(0)
+    return rng.standard_normal((1000,300))+1j*rng.standard_normal((1000,300))
+
+def test_tiles_equal_the_full_image():
+    z = getStft()
+    tiles = TileSource(z, (10,990,5,290), tileSize=64)
+    full = (20*np.log10(np.abs(z[10:990,5:290]))).T
+    for k in range(tiles.levels):
+        expected = poolMax(full, 2**k)
+        (h, w) = tiles.getShape(k)
+        assert expected.shape==(h, w)
+        assert np.allclose(tiles.getImage(k, 0, h, 0, w), expected, atol=1e-4)
+        # a window across tile edges
+        assert np.allclose(tiles.getImage(k, 3, h-1, 7, w), expected[3:h-1,7:w], atol=1e-4)
+    # the coarsest level is one tile
+    assert max(tiles.getShape(tiles.levels-1))<=64
+
+def test_only_recent_tiles_are_kept():
+    tiles = TileSource(getStft(), (0,1000,0,300), tileSize=32, cacheSize=4)
+    (h, w) = tiles.getShape(0)
+    tiles.getImage(0, 0, h, 0, w)
+    assert len(tiles.cache)==4
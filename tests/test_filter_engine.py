@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+from scipy import signal
+from rdsp import storage
+from rdsp.modules.Filter.engine import SOSFilter, design, processFilter
+
+def run(sos, x, blockSize, tmp_path):
+    y = np.full(x.size, np.nan)
+    def write(start, block):
+        y[start:start+block.size] = block
+    SOSFilter(sos, blockSize).process(lambda start, stop: x[start:stop], x.size,
+        write, str(tmp_path/'work.npy'))
+    return y
+
+@pytest.mark.parametrize('blockSize', [7,64,1000,1<<20])
+def test_blocks_equal_sosfiltfilt(blockSize, tmp_path):
+    sos = signal.butter(4, (0.05,0.2), 'bandpass', output='sos')
+    x = np.random.default_rng(0).standard_normal(5000)
+    y = run(sos, x, blockSize, tmp_path)
+    assert np.allclose(y, signal.sosfiltfilt(sos, x), atol=1e-10)
+    # the work file is gone
+    assert not list(tmp_path.iterdir())
+
+def test_short_track_equals_sosfiltfilt(tmp_path):
+    sos = signal.butter(2, 0.3, 'lowpass', output='sos')
+    x = np.random.default_rng(1).standard_normal(10)
+    assert np.allclose(run(sos, x, 3, tmp_path), signal.sosfiltfilt(sos, x))
+
+def test_design_is_shared_and_writable():
+    (a, b) = (design(4, 'highpass', 0.1), design(4, 'highpass', 0.1))
+    assert a.flags.writeable and a is not b
+    assert np.array_equal(a, b)
+    a[0,0] = 0
+    assert np.array_equal(design(4, 'highpass', 0.1), b)
+
+def test_process_filter_into_a_track(tmp_path):
+    sos = design(4, 'lowpass', 0.1)
+    x = np.random.default_rng(2).standard_normal((1,3000))
+    storage.saveTrack(str(tmp_path), 'in', x)
+    for chunked in (False, True):
+        guid = processFilter((str(tmp_path),'in'), (str(tmp_path),'out'), sos, chunked)
+        y = storage.loadTrack(str(tmp_path), guid)
+        assert np.allclose(y, signal.sosfiltfilt(sos, x, axis=-1))
+        storage.removeTrack(str(tmp_path), guid)
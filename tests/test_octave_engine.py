@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+from rdsp.modules.Octave.engine import FilterBank, getBands
+
+SR = 25600.0
+
+def test_third_octave_centres():
+    (fc, lower, upper) = getBands('1/3', 100, 1000, SR)
+    assert np.allclose(fc[[0,-1]], [100,1000], rtol=0.01)
+    assert len(fc)==11
+    assert np.allclose(upper[:-1], lower[1:])
+
+@pytest.mark.parametrize('multirate', [False,True])
+def test_tone_level_in_its_band(multirate):
+    bank = FilterBank('1/1', 60, 4000, SR, multirate=multirate)
+    f = 1000.0
+    x = np.sqrt(2)*np.sin(2*np.pi*f*np.arange(int(4*SR))/SR)
+    rms = bank.process(lambda start, stop: x[start:stop], x.size)
+    band = np.argmin(np.abs(bank.fc-f))
+    # RMS 1 in the band of the tone, settled frames only
+    level = rms[band,rms.shape[1]//2:]
+    assert np.allclose(level, 1.0, atol=0.05)
+    others = np.delete(rms[:,rms.shape[1]//2:], band, axis=0)
+    assert others.max()<0.5
+
+def test_blocks_do_not_change_the_result():
+    bank = FilterBank('1/3', 50, 5000, SR)
+    x = np.random.default_rng(0).standard_normal(int(2*SR))
+    whole = bank.process(lambda start, stop: x[start:stop], x.size)
+    blocks = bank.process(lambda start, stop: x[start:stop], x.size, blockSize=3001)
+    assert np.allclose(whole, blocks)
+    assert whole.shape==(len(bank.fc), bank.getFrameCount(x.size))
@@ -0,0 +1,17 @@
+import math
+import pytest
+from rdsp.parallel import runTasks
+
+def test_results_in_task_order():
+    loi = [3,0,0,False,None]
+    done = []
+    results = runTasks(math.sqrt, [(1,),(4,),(9,)], loi, lambda i, r: done.append(i))
+    assert results==[1.0,2.0,3.0]
+    assert loi[1]==3
+    assert sorted(done)==[0,1,2]
+
+def test_task_error_is_raised_and_reported():
+    loi = [3,0,0,False,None]
+    with pytest.raises(ValueError):
+        runTasks(math.sqrt, [(1,),(-1,),(4,)], loi)
+    assert 'task 1 failed' in loi[4]
@@ -0,0 +1,84 @@
+import os
+import numpy as np
+import pytest
+from rdsp import storage
+
+FILTEROP = 'rdsp.modules.Filter.engine.filterData'
+INTEGRATIONOP = 'rdsp.modules.Integration.engine.integrateData'
+
+@pytest.fixture
+def track(tmp_path):
+    data = np.random.default_rng(0).standard_normal((1,10000))
+    storage.saveTrack(str(tmp_path), 'plain', data)
+    storage.saveChunked(storage.chunkedTrackPath(str(tmp_path),'chunked'), data, chunkSize=999)
+    return (str(tmp_path), data)
+
+@pytest.mark.parametrize('key', [
+    (slice(None),slice(None)), (0,slice(5,17)), (slice(None),slice(990,2011)),
+    (0,slice(9990,None)), (0,slice(100,50)), (0,slice(None,None,-3)),
+    (0,slice(-5,None)), (0,998), (0,-1)
+])
+def test_chunked_slices_equal_the_source(track, key):
+    (sourceDir, data) = track
+    chunked = storage.loadTrack(sourceDir, 'chunked', 'r')
+    assert np.array_equal(chunked[key], data[key])
+
+def test_chunked_read_whole(track):
+    (sourceDir, data) = track
+    assert np.array_equal(storage.loadTrack(sourceDir, 'chunked'), data)
+    assert np.array_equal(storage.loadTrack(sourceDir, 'plain', 'r'), data)
+
+def test_closed_track_is_removed(track):
+    (sourceDir, data) = track
+    chunked = storage.loadTrack(sourceDir, 'chunked', 'r')
+    chunked[0,:10]
+    chunked.close()
+    assert storage.findTrack(sourceDir, 'chunked').endswith(storage.CHUNKEXTENSION)
+    storage.removeTrack(sourceDir, 'chunked')
+    storage.removeTrack(sourceDir, 'plain')
+    assert not os.listdir(sourceDir)
+
+def test_recipe_source(track):
+    from scipy import signal
+    (sourceDir, data) = track
+    sos = signal.butter(4, 0.2, output='sos').tolist()
+    source = (storage.RECIPE, (sourceDir,'plain'), FILTEROP, {'sos':sos})
+    expected = signal.sosfiltfilt(np.array(sos), data, axis=-1)
+    assert np.allclose(storage.openSource(source), expected)
+
+@pytest.mark.parametrize('op, params', [
+    (FILTEROP, {'sos':[[0.2,0.4,0.2,1.0,-0.3,0.1]]}),
+    (INTEGRATIONOP, {'order':1, 'type':'td', 'sr':2560.0})
+])
+def test_evaluated_source_equals_the_recipe(track, op, params):
+    # streamed for the filter, applied at once for the integration
+    (sourceDir, data) = track
+    source = (storage.RECIPE, (sourceDir,'plain'), op, params)
+    storage.evaluateSource(source, (sourceDir,'evaluated'))
+    evaluated = storage.loadTrack(sourceDir, 'evaluated')
+    assert np.allclose(evaluated, storage.openSource(source))
+
+def test_integration_of_a_cosine():
+    from rdsp.modules.Integration.engine import integrateData
+    sr = 2560.0
+    t = np.arange(int(sr))/sr
+    f = 10.0
+    y = integrateData(np.cos(2*np.pi*f*t)[None,:], 1, 'td', sr)
+    # the integral with its linear trend removed, as the engine does
+    expected = np.sin(2*np.pi*f*t)/(2*np.pi*f)
+    expected -= np.polyval(np.polyfit(t,expected,1),t)
+    assert np.allclose(y[0], expected, atol=1e-4)
+
+def test_view_source(track):
+    (sourceDir, data) = track
+    view = storage.openSource((storage.VIEW, (sourceDir,'chunked'), 1000, 500))
+    assert np.array_equal(view, data[:,1000:1500])
+    view = storage.openSource((storage.VIEW, (sourceDir,'plain'), 9800, 200))
+    assert np.array_equal(view, data[:,9800:])
+    assert isinstance(view.base, np.memmap) or isinstance(view, np.memmap)
+
+def test_cancelled_evaluation_leaves_nothing(track):
+    (sourceDir, data) = track
+    source = (storage.RECIPE, (sourceDir,'plain'), FILTEROP, {'sos':[[0.2,0.4,0.2,1.0,-0.3,0.1]]})
+    assert not storage.evaluateSource(source, (sourceDir,'evaluated'), [0,0,0,True])
+    assert sorted(os.listdir(sourceDir))==['chunked.npz','plain.npy']
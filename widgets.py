@@ -16,6 +16,8 @@ class ListWidget(QtGui.QTreeWidget):
 
         self.propertyWindow = None
         self.currentItemChanged.connect(self.showProperty)
+        # guid -> QTreeWidgetItem, for updating one subtree
+        self.nodeItems = {}
 
     def contextMenu(self, position):
         items = self.selectedItems()
@@ -54,9 +56,16 @@ class ListWidget(QtGui.QTreeWidget):
  
     def appendNode(self, parent, node):
         item = QtGui.QTreeWidgetItem(parent)
+        self.fillItem(item, node)
+        return item
+
+    def fillItem(self, item, node):
         item.setText(0,node['type'])
         item.setText(1,node['name'])
         item.setData(0,33,node['object'])
+        # first item wins, FFTFreq shares the guid of its track
+        if node['object'] is not None and node['object'].guid not in self.nodeItems:
+            self.nodeItems[node['object'].guid] = item
         if 'sub' in node:
             for subNode in node['sub']:
                 self.appendNode(item, subNode)
@@ -64,6 +73,73 @@ class ListWidget(QtGui.QTreeWidget):
     def addNode(self, node):
         self.appendNode(self, node)
 
+    def insertNode(self, node, parentGuid=None):
+        if parentGuid is None:
+            self.addNode(node)
+            return True
+        parent = self.nodeItems.get(parentGuid)
+        if parent is None:
+            return False
+        self.appendNode(parent, node)
+        return True
+
+    def removeNode(self, guid):
+        item = self.nodeItems.get(guid)
+        if item is None:
+            return False
+        self.forgetItem(item)
+        parent = item.parent()
+        if parent is None:
+            self.takeTopLevelItem(self.indexOfTopLevelItem(item))
+        else:
+            parent.removeChild(item)
+        return True
+
+    def updateNode(self, node):
+        # rebuild the subtree of node in place, keeping what was expanded
+        item = self.nodeItems.get(node['object'].guid)
+        if item is None or item.data(0,33) is not node['object']:
+            return False
+        expanded = set()
+        self.saveExpanded(item, (), expanded)
+        for i in range(item.childCount()):
+            self.forgetItem(item.child(i))
+        item.takeChildren()
+        self.fillItem(item, node)
+        self.restoreExpanded(item, (), expanded)
+        return True
+
+    def forgetItem(self, item):
+        obj = item.data(0,33)
+        if obj is not None and self.nodeItems.get(obj.guid) is item:
+            del self.nodeItems[obj.guid]
+        for i in range(item.childCount()):
+            self.forgetItem(item.child(i))
+
+    def itemKey(self, item, key):
+        obj = item.data(0,33)
+        return key + (item.text(1) if obj is None else obj.guid,)
+
+    def saveExpanded(self, item, key, expanded):
+        for i in range(item.childCount()):
+            child = item.child(i)
+            childKey = self.itemKey(child, key)
+            if child.isExpanded():
+                expanded.add(childKey)
+            self.saveExpanded(child, childKey, expanded)
+
+    def restoreExpanded(self, item, key, expanded):
+        for i in range(item.childCount()):
+            child = item.child(i)
+            childKey = self.itemKey(child, key)
+            if childKey in expanded:
+                child.setExpanded(True)
+            self.restoreExpanded(child, childKey, expanded)
+
+    def clear(self):
+        super().clear()
+        self.nodeItems.clear()
+
 class PropertyWidget(QtGui.QListWidget):
     def showProperty(self, prop):
         self.clear()